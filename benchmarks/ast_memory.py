@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import tracemalloc
+
+import attr
+from format_sql.parser import parse
+from format_sql.tokenizer import tokenize
+
+
+def make_in_list(size):
+    return 'SELECT a FROM t WHERE id IN (%s);' % ', '.join(
+        '%d' % i for i in range(size))
+
+
+def make_where(size):
+    conditions = ['c%d IS NOT NULL', "c%d = 'x'", 'c%d BETWEEN 1 AND 2',
+                  'NOT c%d LIKE 2']
+    return 'SELECT a FROM t WHERE %s;' % ' AND '.join(
+        conditions[i % len(conditions)] % i for i in range(size))
+
+
+def make_insert(rows):
+    values = ', '.join("(%d, 'name %d', %d.5)" % (i, i, i)
+                       for i in range(rows))
+    return 'INSERT INTO t (id, name, price) VALUES %s;' % values
+
+
+def node_sizes(statements):
+    # number of nodes and the size of the nodes themselves, with their
+    # __dict__ if they have one, but without the values they refer to
+    count = size = 0
+    stack = list(statements)
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+        elif attr.has(value.__class__):
+            count += 1
+            size += sys.getsizeof(value)
+            if hasattr(value, '__dict__'):
+                size += sys.getsizeof(value.__dict__)
+            stack.extend(getattr(value, field.name)
+                         for field in attr.fields(value.__class__))
+    return count, size
+
+
+def main(size=100000):
+    print('%-8s %10s %12s %14s %14s' % ('', 'nodes', 'peak', 'peak per node',
+                                        'size per node'))
+    for name, sql in [('IN list', make_in_list(size)),
+                      ('VALUES', make_insert(size // 3)),
+                      ('WHERE', make_where(size // 5))]:
+        tokens = list(tokenize(sql))
+        tracemalloc.start()
+        statements = list(parse(tokens))
+        unused_current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        count, nodes_size = node_sizes(statements)
+        print('%-8s %10d %12d %14.1f %14.1f' % (
+            name, count, peak, peak / float(count), nodes_size / float(count)))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.parser import parse
+from format_sql.styler import style
+from format_sql.tokenizer import tokenize
+
+SIZES = [5000, 50000]
+MAX_LINE_LENGTH = 79
+
+
+def make_in(size):
+    values = ', '.join('%d' % i for i in range(size))
+    return 'SELECT a FROM t WHERE b IN (%s);' % values
+
+
+def make_insert(size):
+    rows = ', '.join("(%d, 'row %d', 1.5)" % (i, i) for i in range(size))
+    return 'INSERT INTO t (a, b, c) VALUES %s;' % rows
+
+
+def make_select(size):
+    columns = ', '.join('col_%d' % i for i in range(size))
+    return 'SELECT %s FROM t;' % columns
+
+
+def run(name, size, sql):
+    statements = list(parse(tokenize(sql)))
+    for max_line_length in [None, MAX_LINE_LENGTH]:
+        start = time.time()
+        lines = style(statements, max_line_length=max_line_length)
+        duration = time.time() - start
+        print('%-8s %8d %6s %10d %10d %10.3f' % (
+            name, size, max_line_length or '-', len(lines),
+            sum(len(line) + 1 for line in lines), duration))
+
+
+def main(sizes=SIZES):
+    print('%-8s %8s %6s %10s %10s %10s' % ('', 'size', 'width', 'lines',
+                                           'bytes', 'seconds'))
+    for size in sizes:
+        run('in', size, make_in(size))
+    for size in sizes:
+        run('values', size, make_insert(size))
+    for size in sizes:
+        run('select', size, make_select(size))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.parser import parse
+from format_sql.styler import style
+from format_sql.tokenizer import tokenize
+
+DEPTHS = [1000, 2000, 5000]
+
+
+def make_subselects(depth):
+    where = 'a IN (SELECT a FROM t WHERE ' * depth + 'a = 1' + ')' * depth
+    return 'SELECT a FROM t WHERE %s;' % where
+
+
+def make_groups(depth):
+    where = '(a = 1 OR ' * depth + 'b = 2' + ')' * depth
+    return 'SELECT a FROM t WHERE %s;' % where
+
+
+def make_funcs(depth):
+    return 'SELECT %sa%s FROM t;' % ('f(' * depth, ')' * depth)
+
+
+def run(name, depth, sql):
+    tokens = list(tokenize(sql))
+    start = time.time()
+    statements = list(parse(tokens))
+    parsed = time.time()
+    style(statements)
+    styled = time.time()
+    print('%-12s %8d %10d %10.3f %10.3f' % (name, depth, len(tokens),
+                                            parsed - start, styled - parsed))
+
+
+def main(depths=DEPTHS):
+    # the default recursion limit of 1000 frames stays in place
+    print('%-12s %8s %10s %10s %10s' % ('', 'depth', 'tokens', 'parse', 'style'))
+    for depth in depths:
+        run('subselects', depth, make_subselects(depth))
+    for depth in depths:
+        run('groups', depth, make_groups(depth))
+    for depth in depths:
+        run('funcs', depth, make_funcs(depth))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEPTHS)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.parser import parse
+from format_sql.tokenizer import tokenize
+
+SIZES = [1000, 10000, 100000]
+
+
+def make_select(size):
+    columns = ', '.join('col_%d' % i for i in range(size))
+    return 'SELECT %s FROM t;' % columns
+
+
+def make_where(size):
+    conditions = ['c%d IS NOT NULL', "c%d = 'x'", 'c%d BETWEEN 1 AND 2',
+                  'c%d IN (1, 2)']
+    where = ' AND '.join(conditions[i % len(conditions)] % i
+                         for i in range(size))
+    return 'SELECT a FROM t WHERE %s;' % where
+
+
+def make_groups(size):
+    # deeply nested OR groups as written by ORMs
+    where = '(c = 1 OR ' * size + 'c = 0' + ')' * size
+    return 'SELECT a FROM t WHERE %s;' % where
+
+
+def make_joins(size):
+    # the ON clause shapes and NOT func() conditions
+    join = 'JOIN t%d ON (t%d.a = f(b) OR NOT g(c) = %d) AND d IN (1, 2)'
+    joins = ' '.join(join % (i, i, i) for i in range(size // 16))
+    return 'SELECT a FROM t %s;' % joins
+
+
+def make_subselects(size):
+    where = ' OR '.join('c%d IN (SELECT b FROM u WHERE NOT f(c) = 1)' % i
+                        for i in range(size // 16))
+    return 'SELECT a FROM t WHERE %s;' % where
+
+
+def make_insert(size):
+    rows = ', '.join("(%d, 'row %d', 1.5)" % (i, i) for i in range(size))
+    return 'INSERT INTO t (a, b, c) VALUES %s;' % rows
+
+
+def run(name, sql):
+    tokens = list(tokenize(sql))
+    start = time.time()
+    for unused_statement in parse(tokens):
+        pass
+    duration = time.time() - start
+    print('%-10s %10d %10.3f %12.2f' % (name, len(tokens), duration,
+                                        duration * 1e6 / len(tokens)))
+
+
+def main(sizes=SIZES):
+    print('%-10s %10s %10s %12s' % ('', 'tokens', 'seconds', 'us per token'))
+    for size in sizes:
+        run('select', make_select(size))
+    for size in sizes:
+        run('where', make_where(size))
+    for size in sizes:
+        run('groups', make_groups(size))
+    for size in sizes:
+        run('joins', make_joins(size))
+    for size in sizes:
+        run('subselects', make_subselects(size))
+    for size in sizes:
+        run('insert', make_insert(size))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.parser import parse
+from format_sql.styler import style
+from format_sql.tokenizer import tokenize
+
+COUNTS = [10000, 50000]
+
+QUERIES = [
+    'SELECT id, name FROM users WHERE id = %d;',
+    'SELECT COUNT(*) FROM orders WHERE user_id = %d AND status = "open";',
+    'SELECT a.id, b.total FROM accounts a LEFT JOIN balances b '
+    'ON a.id = b.account_id WHERE a.id = %d;',
+    'SELECT name FROM items WHERE price BETWEEN %d AND 100 '
+    'ORDER BY name DESC LIMIT 10;',
+    'SELECT user_id, SUM(amount) FROM payments GROUP BY user_id '
+    'HAVING SUM(amount) > %d;',
+    'SELECT id FROM sessions WHERE token IS NOT NULL AND user_id IN '
+    '(SELECT id FROM users WHERE active = %d);',
+    "INSERT INTO log (level, message) VALUES (%d, 'started');",
+]
+
+
+def make_corpus(count):
+    # every query is parsed on its own, as they come in from a log
+    return [list(parse(tokenize(QUERIES[i % len(QUERIES)] % i)))
+            for i in range(count)]
+
+
+def run(count, repeat=5):
+    corpus = make_corpus(count)
+    durations = []
+    for unused_run in range(repeat):
+        start = time.time()
+        for statements in corpus:
+            style(statements)
+        durations.append(time.time() - start)
+    duration = min(durations)
+    print('%8d %10.3f %14.0f' % (count, duration, count / duration))
+
+
+def main(counts=COUNTS):
+    print('%8s %10s %14s' % ('queries', 'seconds', 'queries per s'))
+    for count in counts:
+        run(count)
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or COUNTS)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.tokenizer import tokenize
+
+
+def make_insert(rows, length):
+    unit = "lorem ipsum it''s \\'quoted\\' "
+    text = unit * (length // len(unit) + 1)
+    values = ',\n'.join("(%d, '%s', 'dolor sit amet')" % (i, text)
+                        for i in range(rows))
+    return 'INSERT INTO t (id, a, b) VALUES\n%s;' % values
+
+
+def enumerate_scan(s):
+    # the former per-character scan of cutter(), for comparison
+    count = 0
+    pos = 0
+    while True:
+        pos = s.find("'", pos)
+        if pos == -1:
+            return count
+        for i, c in enumerate(s[pos + 1:]):
+            if c == "'":
+                break
+        pos += i + 2
+        count += 1
+
+
+def timed(func, sql):
+    start = time.time()
+    func(sql)
+    return time.time() - start
+
+
+def main(rows=500, length=2000):
+    sql = make_insert(rows, length)
+    mb = len(sql) / 1024.0 / 1024.0
+    print('%d rows with strings of %d characters, %.1f MB' % (rows, length, mb))
+
+    for name, func in [('tokenize', lambda s: sum(1 for _ in tokenize(s))),
+                       ('enumerate scan', enumerate_scan)]:
+        duration = timed(func, sql)
+        print('%-16s %8.3f s %8.1f MB/s' % (name, duration, mb / duration))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
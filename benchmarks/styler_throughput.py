@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.parser import parse
+from format_sql.styler import style
+from format_sql.tokenizer import tokenize
+
+SIZES = [1000, 10000, 100000]
+
+
+def make_select(size):
+    columns = ', '.join('col_%d AS c%d' % (i, i) for i in range(size))
+    return 'SELECT %s FROM t;' % columns
+
+
+def make_insert(size):
+    rows = ', '.join("(%d, 'row %d', 1.5)" % (i, i) for i in range(size))
+    return 'INSERT INTO t (a, b, c) VALUES %s;' % rows
+
+
+def make_subselects(size):
+    # every closing parenthesis is added to the last line
+    depth = size // 100
+    where = 'a IN (SELECT a FROM t WHERE ' * depth + 'a = 1' + ')' * depth
+    return 'SELECT a FROM t WHERE %s;' % where
+
+
+def run(name, size, sql, repeat=5):
+    statements = list(parse(tokenize(sql)))
+    durations = []
+    for unused_run in range(repeat):
+        start = time.time()
+        lines = style(statements)
+        durations.append(time.time() - start)
+    duration = min(durations)
+    print('%-10s %8d %10d %10.3f %12.0f' % (name, size, len(lines), duration,
+                                            len(lines) / duration))
+
+
+def main(sizes=SIZES):
+    print('%-10s %8s %10s %10s %12s' % ('', 'size', 'lines', 'seconds',
+                                        'lines per s'))
+    for size in sizes:
+        run('select', size, make_select(size))
+    for size in sizes:
+        run('values', size, make_insert(size))
+    for size in sizes:
+        run('subselects', size, make_subselects(size))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
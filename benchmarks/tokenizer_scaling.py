@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from format_sql.tokenizer import tokenize
+
+STATEMENT = ("SELECT a.id, count(b.x) AS total FROM a LEFT JOIN b ON a.id = b.a_id "
+             "WHERE a.name = 'spam' AND b.y IN (1, 2, 3) GROUP BY a.id;\n")
+
+SIZES = [2 ** 10, 2 ** 14, 2 ** 18, 2 ** 22, 50 * 2 ** 20]
+
+
+def make_sql(size):
+    return STATEMENT * (size // len(STATEMENT) + 1)
+
+
+def main(sizes=SIZES):
+    print('%12s %10s %12s' % ('bytes', 'seconds', 'us per KB'))
+    for size in sizes:
+        sql = make_sql(size)
+        start = time.time()
+        for unused_token in tokenize(sql):
+            pass
+        duration = time.time() - start
+        print('%12d %10.3f %12.1f' % (len(sql), duration,
+                                       duration * 1e6 / (len(sql) / 1024.0)))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
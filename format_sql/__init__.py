@@ -8,7 +8,8 @@ All rights reserved.
 
 """
 from format_sql.parser import InvalidSQL
-from format_sql.shortcuts import format_sql
+from format_sql.shortcuts import format_sql, format_sql_iter
+from format_sql.tokenizer import split_statements
 
 __version__ = '0.12.0'
 __author__ = 'Friedrich Paetzke'
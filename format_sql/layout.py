@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+import attr
+
+
+@attr.s(slots=True, frozen=True)
+class Break(object):
+    """A place to break the line.
+
+    Printed as ``blank`` spaces when the line is not broken, else a new line
+    starts with ``indent``.
+    """
+    blank = attr.ib(default=1)
+    indent = attr.ib(default='')
+
+
+@attr.s(slots=True, frozen=True)
+class Begin(object):
+    """Starts a block, it ends at the matching End.
+
+    The breaks of a block which does not fit on the line are broken all
+    together if it is ``consistent``, else only those which have to be.
+    """
+    consistent = attr.ib(default=False)
+
+
+@attr.s(slots=True, frozen=True)
+class End(object):
+    pass
+
+
+def _sizes(doc):
+    # The size of a Begin is the length of its block and the size of a
+    # Break is the length up to the next Break of its block, both when
+    # printed on one line and including the text which follows up to the
+    # next Break. The document is scanned backwards once, tokens are told
+    # apart by their class since most of them are strings.
+    sizes = [0] * len(doc)
+    rest = 0  # length up to the next Break
+    totals = [0]  # length of the blocks from their End up to here
+    rests = []  # rest at the End of the blocks
+    for i in range(len(doc) - 1, -1, -1):
+        token = doc[i]
+        kind = token.__class__
+        if kind is Break:
+            sizes[i] = token.blank + rest
+            totals[-1] += token.blank
+            rest = 0
+        elif kind is End:
+            totals.append(0)
+            rests.append(rest)
+        elif kind is Begin:
+            total = totals.pop()
+            sizes[i] = rest = total + rests.pop()
+            totals[-1] += total
+        else:
+            rest += len(token)
+            totals[-1] += len(token)
+    return sizes
+
+
+def layout(doc, width, column=0):
+    """Return the lines of the document ``doc`` for lines of ``width``.
+
+    A document is a list of strings, Break, Begin and End. Its first line
+    is continued at ``column``. Blocks are put on one line when they fit,
+    lines only exceed ``width`` for text without breaks. The time taken is
+    linear in the length of the document.
+    """
+    sizes = _sizes(doc)
+    lines = []
+    line = []
+    # for every open block None if it is printed on one line, else whether
+    # it is consistent
+    blocks = []
+    flat = None  # the number of blocks outside the first one on one line
+    for i, token in enumerate(doc):
+        kind = token.__class__
+        if kind is Break:
+            # breaks outside of blocks are inconsistent ones
+            consistent = blocks[-1] if blocks else False
+            if consistent or (consistent is not None and
+                              sizes[i] > width - column):
+                lines.append(''.join(line))
+                line = [token.indent]
+                column = len(token.indent)
+            else:
+                line.append(' ' * token.blank)
+                column += token.blank
+        elif kind is Begin:
+            if flat is None and sizes[i] <= width - column:
+                flat = len(blocks)
+            blocks.append(None if flat is not None else token.consistent)
+        elif kind is End:
+            blocks.pop()
+            if flat == len(blocks):
+                flat = None
+        else:
+            line.append(token)
+            column += len(token)
+    lines.append(''.join(line))
+    return lines
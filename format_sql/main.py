@@ -10,16 +10,26 @@ All rights reserved.
 """
 from __future__ import print_function
 
+import collections
+import mmap
+import multiprocessing
 import os
 import re
+import shutil
 import sys
+import tempfile
 from argparse import ArgumentParser
+from contextlib import closing
 from glob import glob
 
 from format_sql.parser import InvalidSQL
-from format_sql.shortcuts import format_sql
+from format_sql.shortcuts import format_sql, format_sql_iter
+from format_sql.tokenizer import LineIndex, split_statements, text_type
 from format_sql.util import print_data, print_non_data
 
+MMAP_THRESHOLD = 64 * 1024 * 1024
+JOB_BATCH_SIZE = 1024 * 1024
+
 
 def _get_args(call_args):
     parser = ArgumentParser('format-sql')
@@ -39,6 +49,18 @@ def _get_args(call_args):
                         help='Print available debug information.')
     parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
                         help='Print the altered output and do not change the file.')
+    parser.add_argument('--mmap-threshold', dest='mmap_threshold', type=int,
+                        default=MMAP_THRESHOLD, metavar='BYTES',
+                        help='Memory-map SQL files of at least this size, all of them with --jobs.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        metavar='N',
+                        help='Format the statements of a SQL file in N processes.')
+    parser.add_argument('--recover', dest='recover', action='store_true',
+                        default=False,
+                        help='Keep invalid statements of a SQL file as they are and format the rest.')
+    parser.add_argument('--max-line-length', dest='max_line_length', type=int,
+                        default=None, metavar='N',
+                        help='Pack lists into lines of up to N characters.')
 
     args, _unused_unknown_args = parser.parse_known_args(call_args)
     if not args.types:
@@ -76,9 +98,15 @@ def main(args=sys.argv[1:]):
         print_non_data(filename)
 
         if filename.lower().endswith('.py'):
-            lines = handle_py_file(filename, args.debug)
+            lines = handle_py_file(filename, args.debug,
+                                   max_line_length=args.max_line_length)
         else:
-            lines = handle_sql_file(filename, args.debug)
+            # the lines are written while the file is formatted
+            lines = handle_sql_file(filename, args.debug,
+                                    mmap_threshold=args.mmap_threshold,
+                                    jobs=args.jobs, recover=args.recover,
+                                    max_line_length=args.max_line_length,
+                                    stream=True)
 
         _write_back(filename, lines, args.dry_run)
 
@@ -103,7 +131,7 @@ def get_statements(lines):
         yield old_query, query, indent
 
 
-def handle_py_file(filename, debug=False):
+def handle_py_file(filename, debug=False, max_line_length=None):
     with open(filename) as f:
         lines = f.read()
 
@@ -111,8 +139,14 @@ def handle_py_file(filename, debug=False):
         if debug:
             print_non_data('Found query: %s' % query)
 
+        width = max_line_length
+        if width:
+            # the lines are indented in the file, but at least one
+            # character is left
+            width = max(width - len(indent), 1)
+
         try:
-            fmt = format_sql(query, debug)
+            fmt = format_sql(query, debug, max_line_length=width)
         except InvalidSQL as e:
             print_non_data(e)
             continue
@@ -126,26 +160,184 @@ def handle_py_file(filename, debug=False):
     return lines
 
 
-def handle_sql_file(filename, debug=False):
-    with open(filename) as f:
-        lines = f.read()
+def _get_batches(sql, batch_size=JOB_BATCH_SIZE):
+    # Consecutive statements are sent to the workers together, every batch
+    # ends with a complete statement.
+    start = end = None
+    for statement_start, statement_end in split_statements(sql):
+        if start is None:
+            start = statement_start
+        elif statement_end - start > batch_size:
+            yield start, end
+            start = statement_start
+        end = statement_end
+
+    if start is not None:
+        yield start, end
+
+
+def _format_batch(args):
+    sql, debug, recover, max_line_length = args
+    if not recover:
+        return format_sql(sql, debug, max_line_length=max_line_length), []
+
+    errors = []
+    return format_sql(sql, debug, on_error=errors.append,
+                      max_line_length=max_line_length), errors
+
+
+def _imap_bounded(pool, func, items, size):
+    # Like pool.imap for (key, argument) items, but only up to size
+    # arguments are sent ahead of the result which is read. Yields the key
+    # and the pending result of every item in order.
+    pending = collections.deque()
+    for key, argument in items:
+        pending.append((key, pool.apply_async(func, (argument,))))
+        if len(pending) >= size:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def _format_parallel_iter(sql, debug=False, jobs=1,
+                          batch_size=JOB_BATCH_SIZE, on_error=None,
+                          max_line_length=None):
+    batches = ((start, (sql[start:end], debug, on_error is not None,
+                        max_line_length))
+               for start, end in _get_batches(sql, batch_size))
+    line_index = LineIndex(sql)
+
+    def locate(e, start):
+        # the location in the batch becomes one in the file
+        if e.offset is not None:
+            e.offset += start
+            e.line, e.column = line_index.location(e.offset)
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # two batches per process keep the processes busy while the lines
+        # are written, the others are not read yet
+        results = _imap_bounded(pool, _format_batch, batches, 2 * jobs)
+        for i, (start, result) in enumerate(results):
+            try:
+                styled, errors = result.get()
+            except InvalidSQL as e:
+                locate(e, start)
+                raise
+
+            for e in errors:
+                locate(e, start)
+                on_error(e)
+
+            if i:
+                # Same separation as style() puts between statements.
+                yield ''
+                yield ''
+            for line in styled:
+                yield line
+    finally:
+        pool.terminate()
+
+
+def _format_parallel(sql, debug=False, jobs=1, batch_size=JOB_BATCH_SIZE,
+                     on_error=None, max_line_length=None):
+    return list(_format_parallel_iter(sql, debug, jobs, batch_size,
+                                      on_error, max_line_length))
+
+
+def _format_mapped_file(filename, debug=False, jobs=1, on_error=None,
+                        max_line_length=None):
+    with open(filename, 'rb') as f:
+        with closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as m:
+            if jobs > 1:
+                lines = _format_parallel_iter(
+                    m, debug, jobs, on_error=on_error,
+                    max_line_length=max_line_length)
+            else:
+                lines = format_sql_iter(m, debug, on_error=on_error,
+                                        max_line_length=max_line_length)
+            for line in lines:
+                yield line
+
+
+def _format_sql_file(filename, debug, mmap_threshold, jobs, on_error,
+                     max_line_length):
+    # Yields the formatted lines while the file is still open. The batches
+    # of the processes are cut from a mapped file whatever its size, an
+    # empty file can not be mapped.
+    size = os.path.getsize(filename)
+    use_mmap = size and (jobs > 1 or (mmap_threshold is not None and
+                                      0 < mmap_threshold <= size))
+
+    if use_mmap:
+        lines = _format_mapped_file(filename, debug, jobs, on_error,
+                                    max_line_length)
+        for line in lines:
+            yield line
+    else:
+        with open(filename) as f:
+            for line in format_sql_iter(f, debug, on_error=on_error,
+                                        max_line_length=max_line_length):
+                yield line
+
+
+def _report_invalid_statement(e):
+    print_non_data('Statement left unformatted, %s: %s' % (
+        e.__class__.__name__, e))
+
+
+def handle_sql_file(filename, debug=False, mmap_threshold=None, jobs=1,
+                    recover=False, max_line_length=None, stream=False):
+    on_error = _report_invalid_statement if recover else None
+    lines = _format_sql_file(filename, debug, mmap_threshold, jobs, on_error,
+                             max_line_length)
+    if stream:
+        # An InvalidSQL is raised while the lines are read.
+        return lines
 
     try:
-        sql = format_sql(lines, debug)
+        return '\n'.join(lines)
     except InvalidSQL as e:
         print_non_data(e)
         return
 
-    lines = '\n'.join(sql)
-    return lines
+
+def _write_lines(lines, write):
+    for i, line in enumerate(lines):
+        if i:
+            write('\n')
+        write(line)
 
 
 def _write_back(filename, lines, dry_run=False):
+    # lines is either the whole content or an iterable of lines
+    if lines is None:
+        # the file could not be formatted
+        return
+    if isinstance(lines, (str, text_type)):
+        lines = [lines]
+
     if dry_run:
-        print_data(lines)
-    else:
-        with open(filename, 'w') as f:
-            f.write(lines)
+        try:
+            for line in lines:
+                print_data(line)
+        except InvalidSQL as e:
+            print_non_data(e)
+        return
+
+    # The lines go to a temporary file first, the file is only written
+    # once all of them could be formatted. It is written in place, which
+    # keeps links, owner and mode.
+    with tempfile.TemporaryFile('w+') as f:
+        try:
+            _write_lines(lines, f.write)
+        except InvalidSQL as e:
+            print_non_data(e)
+            return
+
+        f.seek(0)
+        with open(filename, 'w') as target:
+            shutil.copyfileobj(f, target)
 
 
 if __name__ == '__main__':
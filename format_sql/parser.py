@@ -7,38 +7,68 @@ Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
+from types import GeneratorType
+
 import attr
-from format_sql.tokenizer import Token
+from format_sql.tokenizer import Token, TokenStream
+from format_sql.util import trampoline
 
+# Tokens a parse function looks ahead of its position at most, a TokenStream
+# has to hold that many tokens in advance.
+LOOKAHEAD = 6
 
-def _match(toks, types_list):
-    if len(toks) < len(types_list):
-        return False
 
-    for tok, types in zip(toks, types_list):
-        if types is None:
-            continue
-        if not isinstance(types, tuple):
+def _pattern(types_list):
+    # None matches any token, everything else becomes a frozenset of types
+    pattern = []
+    for types in types_list:
+        if types is not None and not isinstance(types, tuple):
             types = (types,)
+        pattern.append(None if types is None else frozenset(types))
+    return tuple(pattern)
+
 
-        if tok._type not in types:
+def _match(toks, i, pattern):
+    if len(toks) - i < len(pattern):
+        return False
+
+    for j, types in enumerate(pattern):
+        if types is not None and toks[i + j]._type not in types:
             return False
 
     return True
 
 
 def _get_simple_object(tok, **kwargs):
-    clazz = {
-        Token.IDENTIFIER: Identifier,
-        Token.NUMBER: Number,
-        Token.STR: Str,
-        Token.NOT: Not,
-    }[tok._type]
+    clazz = SIMPLE_OBJECTS[tok._type]
     return clazz(tok._value, **kwargs)
 
 
 class InvalidSQL(Exception):
-    pass
+    offset = None
+    line = None
+    column = None
+
+    def __str__(self):
+        message = super(InvalidSQL, self).__str__()
+        if self.line is None:
+            return message
+
+        location = 'line %s, column %s' % (self.line, self.column)
+        if not message:
+            return location
+        return '%s (%s)' % (message, location)
+
+
+def _normalize_keyword(value):
+    return ' '.join(value.split()).upper()
+
+
+def _error(clazz, toks, i):
+    error = clazz()
+    if i < len(toks):
+        error.offset = toks[i]._offset
+    return error
 
 
 class InvalidSelect(InvalidSQL):
@@ -61,6 +91,10 @@ class InvalidIdentifier(InvalidSQL):
     pass
 
 
+class InvalidInsert(InvalidSQL):
+    pass
+
+
 class InvalidLimit(InvalidSQL):
     pass
 
@@ -73,7 +107,7 @@ class UnbalancedParenthesis(InvalidSQL):
     pass
 
 
-@attr.s
+@attr.s(slots=True)
 class Identifier(object):
     value = attr.ib()
     alias = attr.ib(default=None)
@@ -84,7 +118,7 @@ class Identifier(object):
         return '%s' % self.value
 
 
-@attr.s
+@attr.s(slots=True)
 class Number(object):
     value = attr.ib()
     alias = attr.ib(default=None)
@@ -95,7 +129,7 @@ class Number(object):
         return '%s' % self.value
 
 
-@attr.s
+@attr.s(slots=True)
 class Str(object):
     value = attr.ib()
     alias = attr.ib(default=None)
@@ -106,34 +140,34 @@ class Str(object):
         return '%s' % self.value
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Semicolon(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Is(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Null(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True)
 class GroupBy(object):
     values = attr.ib()
     with_rollup = attr.ib(default=None)
 
 
-@attr.s
+@attr.s(slots=True)
 class From(object):
     value = attr.ib()
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class Func(object):
     name = attr.ib()
     args = attr.ib()
@@ -141,24 +175,24 @@ class Func(object):
     alias = attr.ib(default=None)
 
 
-@attr.s
+@attr.s(slots=True)
 class Having(object):
     value = attr.ib()
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Join(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True)
 class Case(object):
     value = attr.ib()
     when_elses = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class When(object):
     when = attr.ib()
     condition = attr.ib()
@@ -169,7 +203,7 @@ class When(object):
         return 'WHEN %s THEN %s' % (self.condition, self.result)
 
 
-@attr.s
+@attr.s(slots=True)
 class Else(object):
     else_ = attr.ib()
     result = attr.ib()
@@ -178,190 +212,199 @@ class Else(object):
         return 'ELSE %s' % self.result
 
 
-@attr.s
+@attr.s(slots=True)
 class Insert(object):
     insert = attr.ib()
     table = attr.ib()
-    values = attr.ib(default=[])
-    cols = attr.ib(default=[])
-    select = attr.ib(default=[])
+    values = attr.ib(default=attr.Factory(list))
+    cols = attr.ib(default=attr.Factory(list))
+    select = attr.ib(default=attr.Factory(list))
 
 
-@attr.s
+@attr.s(slots=True)
 class Values(object):
     value = attr.ib()
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class Limit(object):
     row_count = attr.ib()
     offset = attr.ib(default=None)
     offset_keyword = attr.ib(default=None)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Link(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Not(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True)
 class On(object):
     value = attr.ib()
-    values = attr.ib(default=[])
+    values = attr.ib(default=attr.Factory(list))
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Between(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Operator(object):
-    value = attr.ib()
+    value = attr.ib(converter=_normalize_keyword)
 
     def __str__(self):
         return '%s' % self.value.upper()
 
 
-@attr.s
+@attr.s(slots=True)
 class OrderBy(object):
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class Condition(object):
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class Select(object):
     value = attr.ib()
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
 class SubSelect(object):
     values = attr.ib()
 
 
-@attr.s
+@attr.s(slots=True)
+class Parenthesis(object):
+    values = attr.ib()
+
+
+@attr.s(slots=True)
 class Where(object):
     value = attr.ib()
     conditions = attr.ib()
 
 
-def _parse_func(toks):
+# Keyword-like nodes are immutable and shared, there is one per class and
+# normalized value.
+KEYWORDS = {}
+
+
+def _keyword(clazz, value):
+    value = _normalize_keyword(value)
+    try:
+        return KEYWORDS[clazz, value]
+    except KeyError:
+        node = KEYWORDS[clazz, value] = clazz(value)
+        return node
+
+
+SIMPLE_OBJECTS = {
+    Token.IDENTIFIER: Identifier,
+    Token.NUMBER: Number,
+    Token.STR: Str,
+    Token.NOT: Not,
+}
+
+VALUE = (Token.IDENTIFIER, Token.NUMBER, Token.STR)
+
+ALIAS_PATTERN = _pattern([VALUE])
+COMMA_PATTERN = _pattern([Token.COMMA])
+LINK_PATTERN = _pattern([Token.LINK])
+OPEN_PATTERN = _pattern([Token.PARENTHESIS_OPEN])
+CLOSE_PATTERN = _pattern([Token.PARENTHESIS_CLOSE])
+SELECT_PATTERN = _pattern([Token.SELECT])
+NOT_OPEN_PATTERN = _pattern([Token.NOT, Token.PARENTHESIS_OPEN])
+NULL_PATTERN = _pattern([Token.NULL])
+NOT_NULL_PATTERN = _pattern([Token.NOT, Token.NULL])
+LIMIT_COMMA_PATTERN = _pattern([Token.LIMIT, Token.NUMBER, Token.COMMA,
+                                Token.NUMBER])
+LIMIT_OFFSET_PATTERN = _pattern([Token.LIMIT, Token.NUMBER, Token.IDENTIFIER,
+                                 Token.NUMBER])
+LIMIT_PATTERN = _pattern([Token.LIMIT, Token.NUMBER])
+SORT_PATTERN = _pattern([None, (Token.ASC, Token.DESC)])
+VALUES_PATTERN = _pattern([Token.VALUES, Token.PARENTHESIS_OPEN])
+NEXT_ROW_PATTERN = _pattern([Token.PARENTHESIS_CLOSE, Token.COMMA,
+                             Token.PARENTHESIS_OPEN])
+WHEN_PATTERN = _pattern([Token.WHEN, VALUE, Token.THEN, VALUE])
+ELSE_PATTERN = _pattern([Token.ELSE, VALUE])
+
+
+def _parse_func(toks, i=0):
+    # the calls nested in the arguments are kept on a stack
+    stack = []
+    start = i
     args = []
-    if toks[0]._type != Token.FUNC:
+    if toks[i]._type != Token.FUNC:
         raise ValueError()
-    if toks[1]._type != Token.PARENTHESIS_OPEN:
-        raise UnbalancedParenthesis()
-
-    i = 2
-    while i < len(toks):
-        if toks[i]._type in (Token.IDENTIFIER, Token.NUMBER, Token.STR):
-            value = _get_simple_object(toks[i])
-            args.append(value)
-            i += 1
-        elif toks[i]._type == Token.FUNC:
-            func, j = _parse_func(toks[i:])
-            args.append(func)
-            i += j
-        elif i != 2 and toks[i]._type != Token.PARENTHESIS_CLOSE:
-            raise InvalidFunc()
-
-        if toks[i]._type == Token.COMMA:
-            i += 1
-        elif toks[i]._type == Token.PARENTHESIS_CLOSE:
-            i += 1
-            break
-        else:
-            raise InvalidFunc()
-    else:
-        raise UnbalancedParenthesis()
 
-    func = Func(toks[0]._value, args)
+    while True:
+        if toks[i + 1]._type != Token.PARENTHESIS_OPEN:
+            raise UnbalancedParenthesis()
+        i += 2
 
-    alias, j = _parse_alias(toks[i:])
-    i += j
-    func.as_ = alias['as']
-    func.alias = alias['alias']
+        while True:
+            if i >= len(toks):
+                raise UnbalancedParenthesis()
 
-    return func, i
+            if toks[i]._type in (Token.IDENTIFIER, Token.NUMBER, Token.STR):
+                value = _get_simple_object(toks[i])
+                args.append(value)
+                i += 1
+            elif toks[i]._type == Token.FUNC:
+                stack.append((start, args))
+                start = i
+                args = []
+                break
+            elif i != start + 2 and toks[i]._type != Token.PARENTHESIS_CLOSE:
+                raise _error(InvalidFunc, toks, i)
+
+            # closing a call may continue the one it is an argument of
+            while i < len(toks) and toks[i]._type == Token.PARENTHESIS_CLOSE:
+                func = Func(toks[start]._value, args)
+                alias, i = _parse_alias(toks, i + 1)
+                func.as_ = alias['as']
+                func.alias = alias['alias']
+                if not stack:
+                    return func, i
+                start, args = stack.pop()
+                args.append(func)
+
+            if i >= len(toks):
+                raise UnbalancedParenthesis()
+            if toks[i]._type != Token.COMMA:
+                raise _error(InvalidFunc, toks, i)
+            i += 1
 
 
-def _parse_from(toks):
-    i = 1
+def _parse_from(toks, i=0):
+    start = i
+    i += 1
     values = []
 
     while len(toks) > i:
         if toks[i]._type in (Token.IDENTIFIER, Token.NUMBER):
-            value, j = _parse_identifier(toks[i:])
-            i += j
+            value, i = _parse_identifier(toks, i)
             values.append(value)
 
         elif toks[i]._type == Token.JOIN:
-            join = Join(toks[i]._value)
+            join = _keyword(Join, toks[i]._value)
             i += 1
             values.append(join)
 
         elif toks[i]._type == Token.ON:
             on = On(toks[i]._value)
-            i += 1
-            vals = []
-
-            while len(toks) > i:
-                if _match(toks[i:], [Token.IDENTIFIER, Token.COMPARE, Token.IDENTIFIER]):
-                    condition = Condition([Identifier(toks[i + 0]._value),
-                                           Operator(toks[i + 1]._value),
-                                           Identifier(toks[i + 2]._value)])
-
-                    vals.append(condition)
-                    i += 3
-
-                if _match(toks[i:], [Token.IDENTIFIER, Token.COMPARE, Token.FUNC]):
-                    func, j = _parse_func(toks[i + 2:])
-                    condition = Condition([Identifier(toks[i + 0]._value),
-                                           Operator(toks[i + 1]._value),
-                                           func])
-                    vals.append(condition)
-                    i += 2 + j
-
-                if _match(toks[i:], [Token.FUNC]):
-                    func, j = _parse_func(toks[i:])
-
-                    if _match(toks[i + j:], [Token.COMPARE, Token.IDENTIFIER]):
-                        i += j
-                        condition = Condition([func,
-                                               Operator(toks[i + 0]._value),
-                                               Identifier(toks[i + 1]._value)])
-                        vals.append(condition)
-                        i += 2
-
-                    elif _match(toks[i + j:], [Token.COMPARE, Token.FUNC]):
-                        i += j
-                        func2, j = _parse_func(toks[i + 1:])
-
-                        condition = Condition([func,
-                                               Operator(toks[i + 0]._value),
-                                               func2])
-                        vals.append(condition)
-                        i += 2 + j
-
-                if len(toks) <= i or toks[i]._type != Token.LINK:
-                    break
-
-                link = Link(toks[i]._value)
-                vals.append(link)
-                i += 1
-
-            on.values = vals
+            on.values, i = yield _parse_conditions(toks, i + 1)
             values.append(on)
 
         elif toks[i]._type == Token.COMMA:
@@ -370,30 +413,29 @@ def _parse_from(toks):
         else:
             break
 
-    from_ = From(toks[0]._value, values)
-    return from_, i
+    from_ = From(toks[start]._value, values)
+    yield from_, i
 
 
-def _parse_alias(toks):
-    i = 0
+def _parse_alias(toks, i=0):
     result = {'as': None, 'alias': None}
     if len(toks) > i and toks[i]._type == Token.AS:
         result['as'] = toks[i]._value
         i += 1
 
-    if _match(toks[i:], [(Token.IDENTIFIER, Token.STR, Token.NUMBER)]):
+    if _match(toks, i, ALIAS_PATTERN):
         result['alias'] = toks[i]._value
         i += 1
     return result, i
 
 
-def _parse_group_by(toks):
+def _parse_group_by(toks, i=0):
     values = []
 
-    i = 1
+    i += 1
     while i < len(toks):
         if toks[i]._type not in (Token.IDENTIFIER, Token.NUMBER):
-            raise InvalidGroupBy()
+            raise _error(InvalidGroupBy, toks, i)
 
         value = _get_simple_object(toks[i])
         values.append(value)
@@ -413,41 +455,41 @@ def _parse_group_by(toks):
     return group_by, i
 
 
-def _parse_having(toks):
-    conditions, j = _parse_conditions(toks[1:])
-    having = Having(toks[0]._value, conditions)
-    return having, j + 1
+def _parse_having(toks, i=0):
+    conditions, j = yield _parse_conditions(toks, i + 1)
+    having = Having(toks[i]._value, conditions)
+    yield having, j
 
 
-def _parse_limit(toks):
-    if len(toks) > 3:
+def _parse_limit(toks, i=0):
+    if len(toks) - i > 3:
 
-        if _match(toks, [Token.LIMIT, Token.NUMBER, Token.COMMA, Token.NUMBER]):
-            return Limit(row_count=Number(toks[3]._value),
-                         offset=Number(toks[1]._value)), 4
+        if _match(toks, i, LIMIT_COMMA_PATTERN):
+            return Limit(row_count=Number(toks[i + 3]._value),
+                         offset=Number(toks[i + 1]._value)), i + 4
 
-        if _match(toks, [Token.LIMIT, Token.NUMBER, Token.IDENTIFIER, Token.NUMBER]):
-            if toks[2]._value.upper() == 'OFFSET':
+        if _match(toks, i, LIMIT_OFFSET_PATTERN):
+            if toks[i + 2]._value.upper() == 'OFFSET':
 
-                return Limit(row_count=Number(toks[1]._value),
-                             offset=Number(toks[3]._value),
-                             offset_keyword=toks[2]._value), 4
+                return Limit(row_count=Number(toks[i + 1]._value),
+                             offset=Number(toks[i + 3]._value),
+                             offset_keyword=toks[i + 2]._value), i + 4
 
-    if _match(toks, [Token.LIMIT, Token.NUMBER]):
-        return Limit(row_count=Number(toks[1]._value)), 2
+    if _match(toks, i, LIMIT_PATTERN):
+        return Limit(row_count=Number(toks[i + 1]._value)), i + 2
 
-    raise InvalidLimit('%s' % toks)
+    raise InvalidLimit('%s' % toks[i:])
 
 
-def _parse_order_by(toks):
+def _parse_order_by(toks, i=0):
     values = []
 
-    i = 1
+    i += 1
     while i < len(toks):
         if not toks[i]._type in (Token.IDENTIFIER, Token.NUMBER):
-            raise InvalidOrderBy()
+            raise _error(InvalidOrderBy, toks, i)
 
-        if _match(toks[i:], [None, (Token.ASC, Token.DESC)]):
+        if _match(toks, i, SORT_PATTERN):
             value = _get_simple_object(toks[i], sort=toks[i + 1]._value)
             values.append(value)
             i += 2
@@ -456,7 +498,7 @@ def _parse_order_by(toks):
             values.append(value)
             i += 1
 
-        if _match(toks[i:], [Token.COMMA]):
+        if _match(toks, i, COMMA_PATTERN):
             i += 1
         else:
             break
@@ -464,87 +506,81 @@ def _parse_order_by(toks):
     return OrderBy(values), i
 
 
-def _parse_insert(toks):
-    assert toks[1]._type == Token.IDENTIFIER
+def _parse_insert(toks, i=0):
+    start = i
+    if i + 1 >= len(toks) or toks[i + 1]._type != Token.IDENTIFIER:
+        raise _error(InvalidInsert, toks, i + 1)
 
-    i = 2
+    i += 2
     columns = []
-    if toks[i]._type == Token.PARENTHESIS_OPEN:
+    if i < len(toks) and toks[i]._type == Token.PARENTHESIS_OPEN:
         i += 1
 
-        while i < len(toks):
-            if toks[i]._type in (Token.NUMBER, Token.STR, Token.IDENTIFIER):
+        while True:
+            if i >= len(toks):
+                raise _error(UnbalancedParenthesis, toks, i)
+            tok_type = toks[i]._type
+            if tok_type in (Token.NUMBER, Token.STR, Token.IDENTIFIER):
                 columns.append(_get_simple_object(toks[i]))
                 i += 1
-
-            if toks[i]._type == Token.COMMA:
+            elif tok_type == Token.COMMA:
                 i += 1
-            elif toks[i]._type == Token.PARENTHESIS_CLOSE:
+            elif tok_type == Token.PARENTHESIS_CLOSE:
                 i += 1
                 break
+            else:
+                raise _error(InvalidInsert, toks, i)
 
+    if i >= len(toks):
+        raise _error(InvalidInsert, toks, i)
     value_val = toks[i]._value
     select = []
     values = []
-    if _match(toks[i:], [Token.VALUES, Token.PARENTHESIS_OPEN]):
+    if _match(toks, i, VALUES_PATTERN):
         i += 2
 
         values_list = []
-        while i < len(toks):
-
-            if toks[i]._type in (Token.IDENTIFIER, Token.NUMBER, Token.STR):
-                values.append(_get_simple_object(toks[i]))
-                i += 1
-
-            if toks[i]._type == Token.COMMA:
-                i += 1
-
-            elif _match(toks[i:], [Token.PARENTHESIS_CLOSE,
-                                   Token.COMMA,
-                                   Token.PARENTHESIS_OPEN]):
-                values_list.append(values)
-                values = []
-                i += 3
-
-            else:
+        while True:
+            row, i = _parse_literals(toks, i)
+            values_list.append(row)
+            if not _match(toks, i, NEXT_ROW_PATTERN):
                 break
+            i += 3
 
-        assert toks[i]._type == Token.PARENTHESIS_CLOSE
+        if not _match(toks, i, CLOSE_PATTERN):
+            raise _error(UnbalancedParenthesis, toks, i)
+        i += 1
 
-        values_list.append(values)
         values = Values(value_val, values_list)
 
     elif toks[i]._type == Token.SELECT:
-        for x, j in _parse(toks[i:]):
-            select.append(x)
-            i += j
+        select, i = yield _parse_statements(toks, i)
 
-    return Insert(toks[0]._value, toks[1]._value, values, cols=columns, select=select), i
+    yield Insert(toks[start]._value, toks[start + 1]._value, values,
+                 cols=columns, select=select), i
 
 
-def _parse_select(toks):
+def _parse_select(toks, i=0):
+    start = i
     values = []
 
-    i = 1
+    i += 1
     while i < len(toks):
 
         if toks[i]._type in (Token.IDENTIFIER, Token.NUMBER):
-            value, j = _parse_identifier(toks[i:])
+            value, i = _parse_identifier(toks, i)
             values.append(value)
-            i += j
 
         elif toks[i]._type == Token.FUNC:
-            func, j = _parse_func(toks[i:])
+            func, i = _parse_func(toks, i)
             values.append(func)
-            i += j
 
         elif toks[i]._type == Token.CASE:
-            value, j = _parse_case(toks[i:])
+            value, i = _parse_case(toks, i)
             values.append(value)
-            i += j
 
         else:
-            raise InvalidSelect()
+            raise _error(InvalidSelect, toks, i)
 
         if i > len(toks) - 1:
             break
@@ -552,19 +588,16 @@ def _parse_select(toks):
             break
         i += 1
 
-    return Select(toks[0]._value, values), i
+    return Select(toks[start]._value, values), i
 
 
-def _parse_case(toks):
-    i = 1
+def _parse_case(toks, i=0):
+    start = i
     when_elses = []
 
+    i += 1
     while i < len(toks):
-        if _match(toks[i:], [
-                Token.WHEN,
-                (Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                Token.THEN,
-                (Token.IDENTIFIER, Token.NUMBER, Token.STR)]):
+        if _match(toks, i, WHEN_PATTERN):
 
             when = When(toks[i + 0]._value,
                         toks[i + 1]._value,
@@ -573,9 +606,7 @@ def _parse_case(toks):
             when_elses.append(when)
             i += 4
 
-        elif _match(toks[i:], [
-                Token.ELSE,
-                (Token.IDENTIFIER, Token.NUMBER, Token.STR)]):
+        elif _match(toks, i, ELSE_PATTERN):
 
             else_ = Else(toks[i + 0]._value,
                          toks[i + 1]._value)
@@ -585,179 +616,257 @@ def _parse_case(toks):
         else:
             break
 
-    return Case(toks[0]._value, when_elses), i
+    return Case(toks[start]._value, when_elses), i
 
 
-def _parse_semicolon(toks):
-    return Semicolon(';'), 1
+def _parse_semicolon(toks, i=0):
+    return _keyword(Semicolon, ';'), i + 1
 
 
-def _parse_where(toks):
-    conditions, j = _parse_conditions(toks[1:])
-    where = Where(toks[0]._value, conditions)
-    return where, j + 1
+def _parse_where(toks, i=0):
+    conditions, j = yield _parse_conditions(toks, i + 1)
+    where = Where(toks[i]._value, conditions)
+    yield where, j
 
 
-def _parse_conditions(toks):
-    conditions = []
+def _parse_operand(toks, i):
+    if i < len(toks):
+        if toks[i]._type in VALUE:
+            return _get_simple_object(toks[i]), i + 1
+        if toks[i]._type == Token.FUNC:
+            return _parse_func(toks, i)
+    raise _error(InvalidCondition, toks, i)
+
 
-    i = 0
+def _parse_literals(toks, i):
+    """Collect the literals of a run of literals and commas.
+
+    The literals are returned as a tuple of their text in the source, no
+    node is built for them.
+    """
+    values = []
     while i < len(toks):
+        tok = toks[i]
+        if tok._type in VALUE:
+            values.append(tok._value)
+        elif tok._type != Token.COMMA:
+            break
+        i += 1
 
-        if _match(toks[i:], [Token.NOT,
-                             (Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                             Token.COMPARE,
-                             (Token.IDENTIFIER, Token.NUMBER, Token.STR)]):
+    return tuple(values), i
 
-            condition = Condition([Not(toks[i]._value),
-                                   _get_simple_object(toks[i + 1]),
-                                   Operator(toks[i + 2]._value),
-                                   _get_simple_object(toks[i + 3])])
-            conditions.append(condition)
-            i += 4
-        elif _match(toks[i:], [(Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                               Token.BETWEEN,
-                               (Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                               Token.LINK,
-                               (Token.IDENTIFIER, Token.NUMBER, Token.STR)]):
-            condition = Condition([
-                _get_simple_object(toks[i]),
-                Between(toks[i + 1]._value),
-                _get_simple_object(toks[i + 2]),
-                Link(toks[i + 3]._value),
-                _get_simple_object(toks[i + 4])
-            ])
-            conditions.append(condition)
-            i += 5
-
-        elif _match(toks[i:], [(Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                               Token.COMPARE,
-                               (Token.IDENTIFIER, Token.NUMBER, Token.STR)]):
-            condition = Condition([_get_simple_object(toks[i]),
-                                   Operator(toks[i + 1]._value),
-                                   _get_simple_object(toks[i + 2])])
-            conditions.append(condition)
-            i += 3
 
-        elif _match(toks[i:], [(Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                               Token.IS,
-                               Token.NULL]):
-            condition = Condition([_get_simple_object(toks[i]),
-                                   Is(toks[i + 1]._value),
-                                   Null(toks[i + 2]._value)])
-            conditions.append(condition)
-            i += 3
+def _parse_close(toks, i):
+    if i >= len(toks):
+        raise UnbalancedParenthesis()
+    if toks[i]._type != Token.PARENTHESIS_CLOSE:
+        raise _error(InvalidCondition, toks, i)
+    return i + 1
 
-        elif _match(toks[i:], [(Token.IDENTIFIER, Token.NUMBER, Token.STR),
-                               Token.IS,
-                               Token.NOT,
-                               Token.NULL]):
-            condition = Condition([_get_simple_object(toks[i]),
-                                   Is(toks[i + 1]._value),
-                                   Not(toks[i + 2]._value),
-                                   Null(toks[i + 3]._value)])
-            conditions.append(condition)
-            i += 4
 
-        elif _match(toks[i:], [Token.NOT, Token.FUNC, None, None, None, None]):
-            func, j = _parse_func(toks[i + 1:])
-            condition = Condition([Not(toks[i]._value),
-                                   func,
-                                   Operator(toks[i + j + 1]._value),
-                                   _get_simple_object(toks[i + j + 2])])
-            conditions.append(condition)
-            i += j
-
-        elif _match(toks, [(Token.IDENTIFIER, Token.NUMBER),
-                           (Token.IN, Token.COMPARE),
-                           Token.PARENTHESIS_OPEN,
-                           None,
-                           None]):
-            condition = Condition([_get_simple_object(toks[i]),
-                                   Operator(toks[i + 1]._value)])
-            i += 3
-            objects = []
-
-            while toks[i]._type != Token.PARENTHESIS_CLOSE:
-                if toks[i]._type in (Token.NUMBER, Token.STR, Token.IDENTIFIER):
-                    value = _get_simple_object(toks[i])
-                    objects.append(value)
-                    i += 1
-                if toks[i]._type == Token.COMMA:
-                    i += 1
-
-                if toks[i]._type == Token.SELECT:
-                    values = []
-                    for x, j in _parse(toks[i:]):
-                        values.append(x)
-                        i += j
-                    objects = SubSelect(values)
+def _parse_list(toks, i):
+    # literals or a sub-select in parentheses, toks[i] is the opening one.
+    # The clauses of a sub-select are left to _parse_conditions, it gets a
+    # SubSelect without values and the position of the first clause.
+    i += 1
+    if _match(toks, i, SELECT_PATTERN):
+        return SubSelect(None), i
+
+    objects, i = _parse_literals(toks, i)
+    return objects, _parse_close(toks, i)
+
+
+def _parse_compare(toks, i, left):
+    operator = _keyword(Operator, toks[i]._value)
+    if _match(toks, i + 1, OPEN_PATTERN):
+        right, i = _parse_list(toks, i + 1)
+    else:
+        right, i = _parse_operand(toks, i + 1)
+    return [left, operator, right], i
+
+
+def _parse_in(toks, i, left):
+    if not _match(toks, i + 1, OPEN_PATTERN):
+        raise _error(InvalidCondition, toks, i + 1)
+    objects, j = _parse_list(toks, i + 1)
+    return [left, _keyword(Operator, toks[i]._value), objects], j
+
+
+def _parse_between(toks, i, left):
+    between = _keyword(Between, toks[i]._value)
+    low, i = _parse_operand(toks, i + 1)
+    if not _match(toks, i, LINK_PATTERN):
+        raise _error(InvalidCondition, toks, i)
+    link = _keyword(Link, toks[i]._value)
+    high, i = _parse_operand(toks, i + 1)
+    return [left, between, low, link, high], i
 
+
+def _parse_is(toks, i, left):
+    is_ = _keyword(Is, toks[i]._value)
+    if _match(toks, i + 1, NULL_PATTERN):
+        return [left, is_, _keyword(Null, toks[i + 1]._value)], i + 2
+    if _match(toks, i + 1, NOT_NULL_PATTERN):
+        return [left, is_, _keyword(Not, toks[i + 1]._value),
+                _keyword(Null, toks[i + 2]._value)], i + 3
+    raise _error(InvalidCondition, toks, i + 1)
+
+
+# What follows the first operand of a condition decides how it goes on.
+PREDICATES = {
+    Token.BETWEEN: _parse_between,
+    Token.COMPARE: _parse_compare,
+    Token.IN: _parse_in,
+    Token.IS: _parse_is,
+}
+
+
+def _parse_condition(toks, i):
+    values = []
+    if toks[i]._type == Token.NOT:
+        values.append(_keyword(Not, toks[i]._value))
+        i += 1
+
+    left, i = _parse_operand(toks, i)
+    if i >= len(toks) or toks[i]._type not in PREDICATES:
+        raise _error(InvalidCondition, toks, i)
+
+    rest, i = PREDICATES[toks[i]._type](toks, i, left)
+    return Condition(values + rest), i
+
+
+def _parse_conditions(toks, i=0):
+    """Parse conditions joined by links.
+
+    The conditions and links of one level are kept in a flat list in the
+    order they appear, a group in parentheses becomes a Condition holding a
+    Parenthesis with its own list. Groups are tracked on a stack, so they
+    may be nested arbitrarily deep. The clauses of a sub-select are parsed
+    by a call through the trampoline.
+    """
+    stack = []
+    conditions = []
+
+    while True:
+        if i >= len(toks):
+            # the keyword, a link or a parenthesis is the last token
+            raise _error(InvalidCondition, toks, i - 1)
+        if _match(toks, i, NOT_OPEN_PATTERN) or _match(toks, i, OPEN_PATTERN):
+            not_ = None
+            if toks[i]._type == Token.NOT:
+                not_ = _keyword(Not, toks[i]._value)
+                i += 1
+            stack.append((conditions, not_))
+            conditions = []
             i += 1
-            condition.values.append(objects)
-            conditions.append(condition)
+            continue
 
-        else:
-            raise InvalidCondition()
+        condition, i = _parse_condition(toks, i)
+        subselect = condition.values[-1]
+        if isinstance(subselect, SubSelect):
+            subselect.values, i = yield _parse_statements(toks, i)
+            i = _parse_close(toks, i)
+        conditions.append(condition)
+
+        while stack and _match(toks, i, CLOSE_PATTERN):
+            group = Parenthesis(conditions)
+            conditions, not_ = stack.pop()
+            conditions.append(Condition([not_, group] if not_ else [group]))
+            i += 1
 
-        if len(toks) <= i or toks[i]._type != Token.LINK:
+        if not _match(toks, i, LINK_PATTERN):
             break
-        link = Link(toks[i]._value)
+        link = _keyword(Link, toks[i]._value)
         conditions.append(link)
         i += 1
 
-    return conditions, i
-
+    if stack:
+        raise _error(UnbalancedParenthesis, toks, i)
+    yield conditions, i
 
-def _parse_identifier(toks):
-    count = 0
 
-    if _match(toks, [(Token.IDENTIFIER, Token.STR, Token.NUMBER)]):
-        if toks[0]._type == Token.IDENTIFIER:
+def _parse_identifier(toks, i=0):
+    if _match(toks, i, ALIAS_PATTERN):
+        if toks[i]._type == Token.IDENTIFIER:
             cls = Identifier
-        elif toks[0]._type == Token.NUMBER:
+        elif toks[i]._type == Token.NUMBER:
             cls = Number
 
-        value = cls(toks[0]._value)
-        count += 1
+        value = cls(toks[i]._value)
+        i += 1
 
-        alias, j = _parse_alias(toks[count:])
-        count += j
+        alias, i = _parse_alias(toks, i)
         value.as_ = alias['as']
         value.alias = alias['alias']
 
-        return value, count
-
-    raise InvalidIdentifier(toks)
-
-
-def _parse(toks):
-    structures = {
-        Token.GROUP_BY: _parse_group_by,
-        Token.FROM: _parse_from,
-        Token.FUNC: _parse_func,
-        Token.HAVING: _parse_having,
-        Token.INSERT: _parse_insert,
-        Token.LIMIT: _parse_limit,
-        Token.ORDER_BY: _parse_order_by,
-        Token.SELECT: _parse_select,
-        Token.SEMICOLON: _parse_semicolon,
-        Token.WHERE: _parse_where,
-    }
-
-    while toks:
-        if toks[0]._type == Token.PARENTHESIS_CLOSE:
-            raise StopIteration
-
-        try:
-            func = structures[toks[0]._type]
-        except KeyError:
-            raise InvalidSQL()
-        statement, count = func(toks)
-        toks = toks[count:]
-        yield statement, count
+        return value, i
+
+    raise InvalidIdentifier(toks[i:])
+
+
+STRUCTURES = {
+    Token.GROUP_BY: _parse_group_by,
+    Token.FROM: _parse_from,
+    Token.FUNC: _parse_func,
+    Token.HAVING: _parse_having,
+    Token.INSERT: _parse_insert,
+    Token.LIMIT: _parse_limit,
+    Token.ORDER_BY: _parse_order_by,
+    Token.SELECT: _parse_select,
+    Token.SEMICOLON: _parse_semicolon,
+    Token.WHERE: _parse_where,
+}
+
+
+def _parse_statement(toks, i):
+    try:
+        func = STRUCTURES[toks[i]._type]
+    except KeyError:
+        raise _error(InvalidSQL, toks, i)
+
+    try:
+        result = func(toks, i)
+        if isinstance(result, GeneratorType):
+            result = yield result
+    except InvalidSQL as e:
+        if e.offset is None:
+            e.offset = toks[i]._offset
+        raise
+    yield result
+
+
+def _parse_statements(toks, i):
+    # the clauses of a sub-select up to its closing parenthesis
+    statements = []
+    while i < len(toks) and toks[i]._type != Token.PARENTHESIS_CLOSE:
+        statement, i = yield _parse_statement(toks, i)
+        statements.append(statement)
+    yield statements, i
+
+
+def _parse(toks, i=0):
+    # Parse functions which may get to a sub-select are generators, they
+    # call each other through the trampoline. Sub-selects can be nested as
+    # deep as memory allows.
+    while i < len(toks):
+        if toks[i]._type == Token.PARENTHESIS_CLOSE:
+            # only a sub-select ends with a closing parenthesis
+            raise _error(UnbalancedParenthesis, toks, i)
+        statement, i = trampoline(_parse_statement(toks, i))
+        yield statement, i
 
 
 def parse(toks):
-    for statement, unused_count in _parse(toks):
+    # Every parse function gets the whole token sequence and the position
+    # to start at and returns what it parsed with the position after it.
+    # Alternatives are told apart by the next few tokens, there is no
+    # backtracking: a function runs at most once per position.
+    if not hasattr(toks, '__getitem__'):
+        # Tokens from an iterator are read as the parser gets to them and
+        # the ones of a statement are dropped as soon as it is yielded.
+        toks = TokenStream(toks, LOOKAHEAD)
+
+    for statement, position in _parse(toks):
+        if isinstance(toks, TokenStream):
+            toks.release(position)
         yield statement
@@ -7,20 +7,144 @@ Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
-from format_sql.parser import parse
-from format_sql.styler import style
-from format_sql.tokenizer import tokenize
+from format_sql.parser import InvalidSQL, parse
+from format_sql.styler import style, style_iter
+from format_sql.tokenizer import (LineIndex, StringNotTerminated, is_file,
+                                  read_chunks, split_statements, text_type,
+                                  tokenize)
 from format_sql.util import print_non_data
 
 
-def format_sql(s, debug=False):
-    tokens = list(tokenize(s))
+def _parse_text(s, debug, zero_copy):
+    # the statements are parsed while the tokens are read from the source
+    tokens = tokenize(s, zero_copy=zero_copy)
     if debug:
+        tokens = list(tokens)
         print_non_data('Tokens: %s' % tokens)
-    parsed = list(parse(tokens))
+    try:
+        for statement in parse(tokens):
+            yield statement
+    except InvalidSQL as e:
+        if e.offset is not None:
+            e.line, e.column = LineIndex(s).location(e.offset)
+        raise
+
+
+def _read_chunks(f):
+    # Yields every chunk with the offset, the line count and the length of
+    # the last line of the chunks before it.
+    offset = lines = column = 0
+    for text in read_chunks(f):
+        yield text, offset, lines, column
+
+        offset += len(text)
+        newline = u'\n' if isinstance(text, text_type) else b'\n'
+        lines += text.count(newline)
+        last_newline = text.rfind(newline)
+        if last_newline < 0:
+            column += len(text)
+        else:
+            column = len(text) - last_newline - 1
+
+
+def _locate(e, offset, lines, column):
+    # moves the location of an error in a chunk to the file
+    if e.offset is not None:
+        if e.line == 1:
+            e.column += column
+        e.offset += offset
+        e.line += lines
+
+
+def _parse_file(f, debug, zero_copy):
+    for text, offset, lines, column in _read_chunks(f):
+        try:
+            for statement in _parse_text(text, debug, zero_copy):
+                yield statement
+        except InvalidSQL as e:
+            _locate(e, offset, lines, column)
+            raise
+
+
+def _style_recovering(text, debug, zero_copy, on_error, max_line_length):
+    # Yields the lines of every statement. A statement which cannot be
+    # formatted is kept as it is and its error is passed to on_error.
+    line_index = LineIndex(text)
+    for start, end in split_statements(text):
+        statement = text[start:end]
+        try:
+            yield style(_parse_text(statement, debug, zero_copy),
+                        max_line_length=max_line_length)
+            continue
+        except InvalidSQL as e:
+            error = e
+        except StringNotTerminated:
+            error = InvalidSQL('String not terminated')
+
+        error.offset = start + (error.offset or 0)
+        error.line, error.column = line_index.location(error.offset)
+        on_error(error)
+
+        if not isinstance(statement, text_type):
+            statement = statement.decode('utf-8')
+        yield statement.rstrip().splitlines()
+
+
+def _format_recovering(s, debug, zero_copy, on_error, max_line_length):
+    if is_file(s):
+        chunks = _read_chunks(s)
+    else:
+        chunks = [(s, 0, 0, 0)]
+
+    first = True
+    for text, offset, lines, column in chunks:
+        def report(e):
+            _locate(e, offset, lines, column)
+            on_error(e)
+
+        for statement in _style_recovering(text, debug, zero_copy, report,
+                                           max_line_length):
+            if not first:
+                # same separation as style() puts between statements
+                yield ''
+                yield ''
+            first = False
+            for line in statement:
+                yield line
+
+
+def format_sql_iter(s, debug=False, zero_copy=False, on_error=None,
+                    max_line_length=None):
+    """Yield the formatted lines of ``s`` one by one.
+
+    Lines are yielded as soon as their statement is formatted, so the
+    output of a large file starts early and is never held as a whole.
+    With a ``max_line_length`` lists are packed into lines of that length
+    instead of putting every item on its own line.
+    """
+    if on_error is not None:
+        # Statements are formatted one by one, invalid ones are kept as
+        # they are and their errors are passed to on_error.
+        return _format_recovering(s, debug, zero_copy, on_error,
+                                  max_line_length)
+
+    if is_file(s):
+        # A file is tokenized and parsed chunk by chunk, every chunk ends
+        # with a complete statement.
+        parsed = _parse_file(s, debug, zero_copy)
+    else:
+        parsed = _parse_text(s, debug, zero_copy)
     if debug:
+        parsed = list(parsed)
         print_non_data('Statements: %s' % parsed)
-    styled = style(parsed)
+    # statements are styled as they are parsed
+    return style_iter(parsed, max_line_length=max_line_length)
+
+
+def format_sql(s, debug=False, zero_copy=False, on_error=None,
+               max_line_length=None):
+    styled = list(format_sql_iter(s, debug, zero_copy, on_error,
+                                  max_line_length))
     if debug:
         print_non_data('Output: %s' % styled)
     return styled
@@ -7,31 +7,82 @@ Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
-from format_sql.parser import (Between, Case, Condition, Else, From, Func,
-                               GroupBy, Having, Identifier, Insert, InvalidSQL,
-                               Is, Join, Limit, Link, Not, Null, Number, On,
-                               Operator, OrderBy, Select, Semicolon, Str,
-                               SubSelect, When, Where)
+from types import GeneratorType
 
+from format_sql.layout import Begin, Break, End, layout
+from format_sql.parser import (Between, Case, From, Func, GroupBy, Having,
+                               Identifier, Insert, InvalidSQL, Is, Join, Limit,
+                               Link, Not, Null, Number, On, Operator, OrderBy,
+                               Parenthesis, Select, Semicolon, Str, SubSelect,
+                               Where)
+from format_sql.util import trampoline
 
-def types_match(condition, types_list):
-    if len(condition.values) != len(types_list):
+INDENT = '    '
+
+
+class _Indents(dict):
+    """Indentation strings by level, every one is built only once.
+
+    Only the levels up to MAX_CACHED are kept, deeper ones are rare and
+    long.
+    """
+
+    MAX_CACHED = 64
+
+    def __missing__(self, level):
+        indent = INDENT * level
+        if level <= self.MAX_CACHED:
+            self[level] = indent
+        return indent
+
+
+INDENTS = _Indents()
+
+
+def types_match(values, types_list):
+    if len(values) != len(types_list):
         return False
 
-    for value, types in zip(condition.values, types_list):
+    for value, types in zip(values, types_list):
         if not isinstance(value, types):
             return False
     return True
 
 
 class Liner:
+    """Output buffer of the styler.
 
-    def __init__(self):
+    The current and the last finished line are kept as lists of fragments,
+    so both can still be appended to. A line is joined once it is neither.
+    With a max_line_length lists are packed into lines of that length.
+    """
+
+    def __init__(self, max_line_length=None):
         self.line = []
-        self.lines = []
+        self.last = None
+        self.finished = []
+        self.max_line_length = max_line_length
+
+    @property
+    def column(self):
+        return sum(len(val) for val in self.line)
+
+    @property
+    def lines(self):
+        if self.last is None:
+            return list(self.finished)
+        return self.finished + [''.join(self.last)]
+
+    def _push(self, line):
+        if self.last is not None:
+            self.finished.append(''.join(self.last))
+        self.last = line
 
     def add_to_line(self, val):
-        self.line.append('%s' % val)
+        if not isinstance(val, str):
+            val = '%s' % val
+        if val:
+            self.line.append(val)
 
     def add_line(self, val):
         self.add_to_line(val)
@@ -40,19 +91,60 @@ class Liner:
     def add_empty_lines(self, count=1):
         self.end_line()
         for _ in range(count):
-            self.lines.append('')
+            self._push([])
 
     def end_line(self):
-        line = ''.join(self.line)
-        if line:
-            self.lines.append(line)
-        self.line = []
+        # empty lines are only added by add_empty_lines
+        if self.line:
+            self._push(self.line)
+            self.line = []
 
     def add_to_last_line(self, val):
-        line = self.lines.pop()
-        self.add_to_line(line)
-        self.add_to_line(val)
-        self.end_line()
+        if self.last is None:
+            raise IndexError('no line to add to')
+        if self.line:
+            # the current line goes in front of the last one
+            self.last = self.line + self.last
+            self.line = []
+
+        if not isinstance(val, str):
+            val = '%s' % val
+        self.last.append(val)
+
+
+def _add_doc(doc, liner):
+    # adds a layout document, its first line continues the current line
+    lines = layout(doc, liner.max_line_length, liner.column)
+    liner.add_to_line(lines[0])
+    for line in lines[1:]:
+        liner.end_line()
+        liner.add_to_line(line)
+
+
+def _fill(items, indent):
+    # A document of the items separated by commas, as many items as fit
+    # are put on a line. An item is a string or a document.
+    separator = (',', Break(indent=indent))
+    doc = [Begin()]
+    for i, item in enumerate(items):
+        if i:
+            doc.extend(separator)
+        if isinstance(item, list):
+            doc.extend(item)
+        else:
+            doc.append(item)
+    doc.append(End())
+    return doc
+
+
+def _flat(value):
+    # the text of a select value
+    liner = Liner()
+    if isinstance(value, Func):
+        _style_func(value, liner, end_line=False)
+    else:
+        _style_identifier(value, liner, end_line=False)
+    return ''.join(liner.line)
 
 
 def _style_identifier(identifier, liner, end_line=True):
@@ -70,14 +162,14 @@ def _style_identifier(identifier, liner, end_line=True):
 
 
 def _style_from(from_, liner, indent):
-    liner.add_line('    ' * indent + 'FROM')
+    liner.add_line(INDENTS[indent] + 'FROM')
 
     i = 0
     while i < len(from_.values):
         value = from_.values[i]
 
         if isinstance(value, Join):
-            liner.add_to_line('    ' * (indent + 1))
+            liner.add_to_line(INDENTS[indent + 1])
             liner.add_to_line(value.value.upper())
             liner.add_to_line(' ')
 
@@ -89,35 +181,14 @@ def _style_from(from_, liner, indent):
             i += 1
 
         elif isinstance(value, Identifier):
-            liner.add_to_line('    ' * (indent + 1))
+            liner.add_to_line(INDENTS[indent + 1])
             _style_identifier(value, liner, end_line=False)
 
             if i + 1 < len(from_.values) and not isinstance(from_.values[i + 1], Join):
                 liner.add_to_line(',')
 
         elif isinstance(value, On):
-            new_line = True
-
-            for v in value.values:
-                if new_line:
-                    liner.add_to_line('    ' * (indent + 2))
-
-                if isinstance(v, Link):
-                    liner.add_to_line('AND ')
-                    new_line = False
-
-                elif isinstance(v, Condition):
-                    for vv in v.values:
-                        if isinstance(vv, Func):
-                            _style_func(vv, liner, end_line=False)
-                        elif isinstance(vv, Identifier):
-                            liner.add_to_line('%s' % vv)
-                        else:
-                            liner.add_to_line(' %s ' % vv)
-
-                    liner.end_line()
-                    new_line = True
-
+            yield _style_conditions(value.values, liner, indent + 1)
             i += 1
 
         liner.end_line()
@@ -125,16 +196,21 @@ def _style_from(from_, liner, indent):
 
 
 def _style_group_by(group_by, liner, indent):
-    liner.add_line('    ' * indent + 'GROUP BY')
+    liner.add_line(INDENTS[indent] + 'GROUP BY')
 
-    for i, value in enumerate(group_by.values):
-        liner.add_to_line('    %s' % value)
-        if i + 1 < len(group_by.values):
-            liner.add_to_line(',')
+    if liner.max_line_length:
+        liner.add_to_line('    ')
+        _add_doc(_fill(['%s' % x for x in group_by.values], '    '), liner)
         liner.end_line()
+    else:
+        for i, value in enumerate(group_by.values):
+            liner.add_to_line('    %s' % value)
+            if i + 1 < len(group_by.values):
+                liner.add_to_line(',')
+            liner.end_line()
 
     if group_by.with_rollup:
-        liner.add_line('    ' * (indent + 1) + 'WITH ROLLUP')
+        liner.add_line(INDENTS[indent + 1] + 'WITH ROLLUP')
 
 
 def _style_limit(limit, liner, indent):
@@ -146,14 +222,27 @@ def _style_limit(limit, liner, indent):
     else:
         line = 'LIMIT %s' % limit.row_count.value
 
-    liner.add_line('    ' * indent + line)
+    liner.add_line(INDENTS[indent] + line)
 
 
 def _style_order_by(order_by, liner, indent):
-    liner.add_line('    ' * indent + 'ORDER BY')
+    liner.add_line(INDENTS[indent] + 'ORDER BY')
+
+    if liner.max_line_length:
+        items = []
+        for value in order_by.values:
+            if value.sort:
+                items.append('%s %s' % (value, value.sort.upper()))
+            else:
+                items.append('%s' % value)
+        liner.add_to_line(INDENTS[indent + 1])
+        _add_doc(_fill(items, INDENTS[indent + 1]), liner)
+        liner.end_line()
+        return
 
     for i, value in enumerate(order_by.values):
-        liner.add_to_line('    ' * (indent + 1) + '%s' % value)
+        liner.add_to_line(INDENTS[indent + 1])
+        liner.add_to_line(value)
 
         if value.sort:
             sort = value.sort.upper()
@@ -166,119 +255,178 @@ def _style_order_by(order_by, liner, indent):
 
 
 def _style_having(having, liner, indent):
-    liner.add_line('    ' * indent + 'HAVING')
-
-    i = 0
-    while i < len(having.values):
-        liner.add_to_line('    ' * (indent + 1))
-
-        if isinstance(having.values[i], Link):
-            liner.add_to_line('%s ' % having.values[i].value.upper())
-            i += 1
-
-        condition = having.values[i]
-
-        if types_match(condition, [Identifier, Operator, Number]):
-            liner.add_to_line(' '.join('%s' % x for x in condition.values))
-            i += 1
-            liner.end_line()
-
-        if types_match(condition, [Not, Func, Operator, Number]):
-            liner.add_to_line('NOT')
-            liner.add_to_line(' ')
-            _style_func(condition.values[1], liner, end_line=False)
-            liner.add_to_line(' ')
-            liner.add_to_line(condition.values[2])
-            liner.add_to_line(' ')
-            liner.add_to_line(condition.values[3])
-            i += 1
-
-    liner.end_line()
+    liner.add_line(INDENTS[indent] + 'HAVING')
+    yield _style_conditions(having.values, liner, indent)
 
 
 def _style_condition(condition, liner, indent):
-
-    if len(condition.values) == 4 and isinstance(condition.values[0], Not):
+    # the condition is only read, it may be styled again
+    values = condition.values
+    if len(values) == 4 and isinstance(values[0], Not):
         liner.add_to_line('NOT ')
-        condition.values.pop(0)
-
-    if types_match(condition, [(Identifier, Number, Str),
-                               Operator,
-                               (Identifier, Number, Str)]):
-
-        liner.add_to_line(' '.join('%s' % x for x in condition.values))
-
-    elif types_match(condition, [(Identifier, Number, Str),
-                                 Between,
-                                 (Identifier, Number, Str),
-                                 Link,
-                                 (Identifier, Number, Str)]):
-        liner.add_to_line('%s BETWEEN %s AND %s' % (condition.values[0],
-                                                    condition.values[2],
-                                                    condition.values[4]))
-
-    elif types_match(condition, [(Identifier, Number, Str), Is, Null]):
-        liner.add_to_line('%s IS NULL' % condition.values[0])
-
-    elif types_match(condition, [(Identifier, Number, Str), Is, Not, Null]):
-        liner.add_to_line('%s IS NOT NULL' % condition.values[0])
-
-    elif types_match(condition, [(Identifier, Number, Str), Operator, list]):
-        liner.add_to_line('%s IN (' % condition.values[0])
+        values = values[1:]
+
+    if types_match(values, [(Identifier, Number, Str),
+                            Operator,
+                            (Identifier, Number, Str)]):
+
+        liner.add_to_line(' '.join('%s' % x for x in values))
+
+    elif types_match(values, [(Identifier, Number, Str),
+                              Between,
+                              (Identifier, Number, Str),
+                              Link,
+                              (Identifier, Number, Str)]):
+        liner.add_to_line('%s BETWEEN %s AND %s' % (values[0], values[2],
+                                                    values[4]))
+
+    elif types_match(values, [(Identifier, Number, Str), Is, Null]):
+        liner.add_to_line('%s IS NULL' % values[0])
+
+    elif types_match(values, [(Identifier, Number, Str), Is, Not, Null]):
+        liner.add_to_line('%s IS NOT NULL' % values[0])
+
+    elif (types_match(values, [(Identifier, Number, Str), Operator, tuple])
+          and liner.max_line_length):
+        # on one line if it fits, else the values are packed into lines
+        # below
+        indent_values = INDENTS[indent + 2]
+        _add_doc(['%s %s (' % (values[0], str(values[1]).upper()),
+                  Begin(consistent=True),
+                  Break(blank=0, indent=indent_values)] +
+                 _fill(['%s' % x for x in values[2]], indent_values) +
+                 [')', End()], liner)
+
+    elif types_match(values, [(Identifier, Number, Str), Operator, tuple]):
+        liner.add_to_line('%s %s (' % (values[0], str(values[1]).upper()))
         liner.end_line()
 
-        for j, value in enumerate(condition.values[2]):
-            liner.add_to_line('    ' * (indent + 2))
+        for j, value in enumerate(values[2]):
+            liner.add_to_line(INDENTS[indent + 2])
 
             liner.add_to_line(value)
-            if j + 1 < len(condition.values[2]):
+            if j + 1 < len(values[2]):
                 liner.add_to_line(',')
 
             else:
                 liner.add_to_line(')')
             liner.end_line()
 
-    elif types_match(condition, [Identifier, Operator, SubSelect]):
-        liner.add_to_line('%s %s (' % (condition.values[0],
-                                       str(condition.values[1]).upper()))
+    elif types_match(values, [Identifier, Operator, SubSelect]):
+        liner.add_to_line('%s %s (' % (values[0], str(values[1]).upper()))
         liner.end_line()
-        style(condition.values[2].values, liner=liner, indent=indent + 2)
+        yield _style_statements(values[2].values, liner, indent + 2)
         liner.add_to_last_line(')')
 
+    else:
+        yield _style_condition_values(values, liner, indent)
+
     liner.end_line()
 
 
-def _style_where(where, liner, indent):
-    liner.add_line('    ' * indent + 'WHERE')
+def _style_condition_values(values, liner, indent):
+    for i, value in enumerate(values):
+        if i:
+            liner.add_to_line(' ')
+
+        if isinstance(value, Func):
+            _style_func(value, liner, end_line=False)
+        elif isinstance(value, Parenthesis):
+            liner.add_to_line('(')
+            liner.end_line()
+            yield _style_conditions(value.values, liner, indent + 1)
+            liner.add_to_last_line(')')
+        elif isinstance(value, SubSelect):
+            liner.add_to_line('(')
+            liner.end_line()
+            yield _style_statements(value.values, liner, indent + 2)
+            liner.add_to_last_line(')')
+        elif isinstance(value, tuple):
+            liner.add_to_line('(%s)' % ', '.join('%s' % x for x in value))
+        elif isinstance(value, (Between, Is, Link, Not, Null)):
+            liner.add_to_line(value.value.upper())
+        else:
+            liner.add_to_line(value)
+
+
+def _is_flat(condition):
+    # whether the condition is styled on one line
+    return isinstance(condition, Link) or not any(
+        isinstance(value, (Parenthesis, SubSelect, tuple))
+        for value in condition.values)
+
+
+def _style_flat_conditions(conditions, liner, indent):
+    # all conditions on one line if they fit, else one per line
+    if not conditions:
+        return
+    if isinstance(conditions[-1], Link):
+        # a link without a condition, as without a line length
+        raise InvalidSQL()
+
+    doc = [Begin(consistent=True)]
+    for i, condition in enumerate(conditions):
+        if isinstance(condition, Link):
+            if i:
+                doc.append(Break(indent=INDENTS[indent + 1]))
+            doc.append('%s ' % condition.value.upper())
+        else:
+            condition_liner = Liner()
+            trampoline(_style_condition(condition, condition_liner, indent))
+            doc.extend(condition_liner.lines)
+    doc.append(End())
+
+    liner.add_to_line(INDENTS[indent + 1])
+    _add_doc(doc, liner)
+    liner.end_line()
+
+
+def _style_conditions(conditions, liner, indent):
+    if liner.max_line_length and all(_is_flat(x) for x in conditions):
+        _style_flat_conditions(conditions, liner, indent)
+        return
 
     i = 0
-    while i < len(where.conditions):
-        liner.add_to_line('    ' * (indent + 1))
-        if isinstance(where.conditions[i], Link):
-            liner.add_to_line('%s ' % where.conditions[i].value.upper())
+    while i < len(conditions):
+        liner.add_to_line(INDENTS[indent + 1])
+        if isinstance(conditions[i], Link):
+            liner.add_to_line('%s ' % conditions[i].value.upper())
             i += 1
 
-        _style_condition(where.conditions[i], liner, indent)
+        yield _style_condition(conditions[i], liner, indent)
         i += 1
 
 
+def _style_where(where, liner, indent):
+    liner.add_line(INDENTS[indent] + 'WHERE')
+    yield _style_conditions(where.conditions, liner, indent)
+
+
 def _style_func(func, liner, end_line=True):
+    # the calls nested in the arguments are kept on a stack
     liner.add_to_line(func.name.upper())
     liner.add_to_line('(')
-
-    for i, arg in enumerate(func.args):
-        if isinstance(arg, (Identifier, Str, Number)):
-            liner.add_to_line(arg)
-        elif isinstance(arg, Func):
-            _style_func(arg, liner, end_line=False)
-
-        if i + 1 < len(func.args):
-            liner.add_to_line(', ')
-
-    liner.add_to_line(')')
-    if func.as_ and func.alias:
-        liner.add_to_line(' AS ')
-        liner.add_to_line(func.alias)
+    stack = [(func, enumerate(func.args))]
+
+    while stack:
+        func, args = stack[-1]
+        for i, arg in args:
+            if i:
+                liner.add_to_line(', ')
+
+            if isinstance(arg, (Identifier, Str, Number)):
+                liner.add_to_line(arg)
+            elif isinstance(arg, Func):
+                liner.add_to_line(arg.name.upper())
+                liner.add_to_line('(')
+                stack.append((arg, enumerate(arg.args)))
+                break
+        else:
+            stack.pop()
+            liner.add_to_line(')')
+            if func.as_ and func.alias:
+                liner.add_to_line(' AS ')
+                liner.add_to_line(func.alias)
 
     if end_line:
         liner.end_line()
@@ -287,7 +435,8 @@ def _style_func(func, liner, end_line=True):
 def _style_case(case, liner, indent):
     liner.add_line(case.value.upper())
     for i, when_else in enumerate(case.when_elses):
-        liner.add_to_line('%s%s' % ('    ' * (indent + 2), when_else))
+        liner.add_to_line(INDENTS[indent + 2])
+        liner.add_to_line(when_else)
 
         if i < len(case.when_elses) - 1:
             liner.end_line()
@@ -300,7 +449,21 @@ def _style_insert(insert, liner, indent):
         liner.add_to_last_line(' (%s)' %
                                ', '.join('%s' % x for x in insert.cols))
 
-    if insert.values:
+    if insert.values and liner.max_line_length:
+        liner.add_line('VALUES')
+        rows = []
+        for values in insert.values.values:
+            values = ['%s' % x for x in values]
+            row = '(%s)' % ', '.join(values)
+            if len(row) > liner.max_line_length - len('    ,'):
+                # the row is longer than a line, it is broken as well
+                row = ['('] + _fill(values, INDENTS[2]) + [')']
+            rows.append(row)
+        liner.add_to_line('    ')
+        _add_doc(_fill(rows, '    '), liner)
+        liner.end_line()
+
+    elif insert.values:
         liner.add_line('VALUES')
         for i, values in enumerate(insert.values.values):
             liner.add_line('    (%s)' % ', '.join('%s' % x for x in values))
@@ -309,14 +472,22 @@ def _style_insert(insert, liner, indent):
                 liner.add_to_last_line(',')
 
     elif insert.select:
-        style(insert.select, liner=liner, indent=indent)
+        yield _style_statements(insert.select, liner, indent)
 
 
 def _style_select(select, liner, indent):
-    liner.add_line('    ' * indent + select.value.upper())
+    liner.add_line(INDENTS[indent] + select.value.upper())
+
+    if (liner.max_line_length and
+            not any(isinstance(x, Case) for x in select.values)):
+        liner.add_to_line(INDENTS[indent + 1])
+        _add_doc(_fill([_flat(x) for x in select.values], INDENTS[indent + 1]),
+                 liner)
+        liner.end_line()
+        return
 
     for i, value in enumerate(select.values):
-        liner.add_to_line('    ' * (indent + 1))
+        liner.add_to_line(INDENTS[indent + 1])
         if isinstance(value, (Identifier, Str, Number)):
             _style_identifier(value, liner, end_line=False)
 
@@ -335,32 +506,78 @@ def _style_semicolon(semicolon, liner, indent):
     liner.add_to_last_line(semicolon.value)
 
 
-def style(statements, indent=0, keyword_upper=True, liner=None):
-    if not liner:
-        liner = Liner()
-
-    structures = {
-        From: _style_from,
-        GroupBy: _style_group_by,
-        Having: _style_having,
-        Insert: _style_insert,
-        Limit: _style_limit,
-        OrderBy: _style_order_by,
-        Select: _style_select,
-        Semicolon: _style_semicolon,
-        Where: _style_where,
-    }
-
-    for i, statement in enumerate(statements):
-        func = structures[statement.__class__]
-        try:
-            func(statement, liner=liner, indent=indent)
-        except IndexError:
-            raise InvalidSQL()
-
-        if isinstance(statement, Semicolon) and len(statements) > i + 1:
+STRUCTURES = {
+    From: _style_from,
+    GroupBy: _style_group_by,
+    Having: _style_having,
+    Insert: _style_insert,
+    Limit: _style_limit,
+    OrderBy: _style_order_by,
+    Select: _style_select,
+    Semicolon: _style_semicolon,
+    Where: _style_where,
+}
+
+
+def _separated(statements, liner):
+    # Yields the statements and puts the empty lines between separate ones.
+    # statements may be a generator, one statement is read ahead to know
+    # whether another one follows.
+    statements = iter(statements)
+    statement = next(statements, None)
+    while statement is not None:
+        yield statement
+
+        previous, statement = statement, next(statements, None)
+        if isinstance(previous, Semicolon) and statement is not None:
             # statements holds multiple separate statements
             liner.add_empty_lines(count=2)
 
+
+def _style_statement(statement, liner, indent):
+    # only the styling functions which are generators go through the
+    # trampoline
+    func = STRUCTURES[statement.__class__]
+    try:
+        styled = func(statement, liner=liner, indent=indent)
+        if isinstance(styled, GeneratorType):
+            yield styled
+    except IndexError:
+        raise InvalidSQL()
+
+
+def _style_statements(statements, liner, indent):
+    for statement in _separated(statements, liner):
+        yield _style_statement(statement, liner, indent)
     liner.end_line()
+
+
+def style(statements, indent=0, keyword_upper=True, liner=None,
+          max_line_length=None):
+    # Style functions which may get to a sub-select or a nested group are
+    # generators, they call each other through the trampoline.
+    if not liner:
+        liner = Liner(max_line_length)
+
+    trampoline(_style_statements(statements, liner, indent))
     return liner.lines
+
+
+def style_iter(statements, indent=0, max_line_length=None):
+    """Yield the styled lines as soon as they are finished.
+
+    The lines of a statement come out once it is styled, only the last
+    line is held back in case something is added to it. With a generator
+    of statements the output starts before all of them are parsed.
+    """
+    liner = Liner(max_line_length)
+    for statement in _separated(statements, liner):
+        trampoline(_style_statement(statement, liner, indent))
+
+        finished, liner.finished = liner.finished, []
+        for line in finished:
+            yield line
+
+    liner.end_line()
+    for line in liner.lines:
+        yield line
@@ -7,8 +7,12 @@ Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
+import codecs
+import mmap
 import re
-from collections import OrderedDict
+from array import array
+from bisect import bisect_left
+from itertools import islice
 
 
 class StringNotTerminated(Exception):
@@ -51,28 +55,23 @@ class Token:
     THEN = 'THEN'
     ELSE = 'ELSE'
 
-    def __init__(self, token_type, token_value):
+    def __init__(self, token_type, token_value, offset=None):
         self._type = token_type
         self._value = token_value
+        self._offset = offset
 
     def __repr__(self):
         return '<%s: %s>' % (self._type, self._value)
 
-    @staticmethod
-    def get_token(value):
-        normalized = value.split()[0].upper()
 
-        if normalized in TOKEN_RES.keys():
-            return normalized
+# Inside of a string literal its quote is escaped by doubling it or with a
+# backslash. The patterns consume runs of ordinary characters at once.
+STR_RES = [r'"[^"\\]*(?:(?:\\[\s\S]|"")[^"\\]*)*"',
+           r"'[^'\\]*(?:(?:\\[\s\S]|'')[^'\\]*)*'"]
 
-        normalized = value.split()[-1].upper()
-        if normalized == 'JOIN':
-            return Token.JOIN
 
-        return None
-
-
-TOKEN_RES = OrderedDict([
+TOKEN_RES = [
+    (Token.STR, STR_RES),
     (Token.INSERT, [r'\binsert\s+into\b']),
     (Token.VALUES, [r'\bvalues\b']),
     (Token.IN, [r'\bin\b']),
@@ -96,99 +95,370 @@ TOKEN_RES = OrderedDict([
     (Token.LINK, [r'\band\b', r'\bor\b']),
     (Token.NOT, [r'\bnot\b']),
     (Token.ORDER_BY, [r'\border\s+by\b']),
-    (Token.PARENTHESIS_CLOSE, [r'\(']),
-    (Token.PARENTHESIS_OPEN, [r'\)']),
+    (Token.PARENTHESIS_OPEN, [r'\(']),
+    (Token.PARENTHESIS_CLOSE, [r'\)']),
     (Token.WITH_ROLLUP, [r'\bwith\s+rollup\b']),
     (Token.WHERE, [r'\bwhere\b']),
-    (Token.FUNC, [r'\b\w+\b\s*\(']),
-    (Token.JOIN, [r'\bleft\s+outer\s+join\b', r'\bleft\s+join\b',
-                  r'\bright\s+outer\s+join\b', r'\bright\s+join\b',
-                  r'\bnatural\s+join\b', r'\binner\s+join\b',
-                  r'\bjoin\b']),
     (Token.BETWEEN, [r'\bbetween\b']),
     (Token.CASE, [r'\bcase\b']),
     (Token.WHEN, [r'\bwhen\b']),
     (Token.THEN, [r'\bthen\b']),
     (Token.ELSE, [r'\belse\b']),
-])
+    (Token.FUNC, [r'\b\w+\b\s*\(']),
+    (Token.JOIN, [r'\bleft\s+outer\s+join\b', r'\bleft\s+join\b',
+                  r'\bright\s+outer\s+join\b', r'\bright\s+join\b',
+                  r'\bnatural\s+join\b', r'\binner\s+join\b',
+                  r'\bjoin\b']),
+    # first words of keywords which can also stand on their own
+    (Token.INSERT, [r'\binsert\b']),
+    (Token.GROUP_BY, [r'\bgroup\b']),
+    (Token.ORDER_BY, [r'\border\b']),
+    (Token.WITH_ROLLUP, [r'\bwith\b']),
+    (Token.NUMBER, [r'[-+]?\d+\.?\d*']),
+    (Token.IDENTIFIER, [r'`\w+`\.`\w+`',  # `t1`.`t2`
+                        r'`\w+`',
+                        r'\b\w+\.\w+\b',
+                        r'\b\w+\.\*']),
+    (Token.COMPARE, [r'\blike\b']),
+    (Token.IDENTIFIER, [r'\b\w+\b',
+                        r'%\(\w+\)s',  # %(arg)s
+                        r'%s',  # %s
+                        r'\*']),
+]
+
+
+# Every entry of TOKEN_RES becomes a named group, so the name of the group
+# that matched tells the token type. Whitespace is matched as a whole and
+# skipped. Matching always starts at the cursor position, which has to
+# behave like the start of the string, so a leading word boundary is dropped.
+GROUP_TYPES = {'space': None}
+group_res = [r'(?P<space>\s+)']
+for i, (token_type, res) in enumerate(TOKEN_RES):
+    name = 't%d' % i
+    GROUP_TYPES[name] = token_type
+    group_res.append(r'(?P<%s>%s)' % (
+        name, r'|'.join(re.sub(r'^\\b', '', s) for s in res)))
+
+
+reg_ex = r'|'.join(group_res)
+sql_re = re.compile(reg_ex, re.IGNORECASE)
 
+# The same lexer for bytes-like input (bytes, memoryview, mmap). It only
+# sees ASCII text, where it matches like the one for text: input with
+# characters which \s and \w treat differently for bytes, the non-ASCII
+# ones and the separators \x1c-\x1f, is decoded and lexed as text.
+sql_bytes_re = re.compile(reg_ex.encode('ascii'), re.IGNORECASE)
+bytes_not_ascii_re = re.compile(br'[\x1c-\x1f\x80-\xff]')
 
-token_res = []
-for res in TOKEN_RES.values():
-    token_res.extend(res)
 
+STR_STARTERS = ('"', "'")
+BYTES_STR_STARTERS = (b'"', b"'")
 
-token_res.append(r'[-+]?\d+\.?\d*')
-token_res.append(r'`\w+`\.`\w+`')  # `t1`.`t2`
-token_res.append(r'`\w+`')
-token_res.append(r'\b\w+\.\w+\b')
-token_res.append(r'\b\w+\.\*')
-token_res.append(r'\b\w+\b')
+CHUNK_SIZE = 64 * 1024
 
-token_res.append(r'%\(\w+\)s')  # %(arg)s
-token_res.append(r'%s')  # %s
-token_res.append(r'\*')
+chunk_re = re.compile(r'[;"\']')
+bytes_chunk_re = re.compile(br'[;"\']')
+# The rest of a string literal after its opening quote, with and without
+# the closing quote, by quote.
+str_rest_res = dict((pattern[0], (re.compile(pattern[1:]),
+                                  re.compile(pattern[1:-1])))
+                    for pattern in STR_RES)
+bytes_str_rest_res = dict(
+    (pattern[0].encode('ascii'), (re.compile(pattern[1:].encode('ascii')),
+                                  re.compile(pattern[1:-1].encode('ascii'))))
+    for pattern in STR_RES)
 
+# String literals are skipped as a whole, a quote which is left over is not
+# terminated. Comments are no SQL syntax to the tokenizer, so they are not
+# either here.
+statement_end_res = STR_RES + [r'(?P<end>;)', r'(?P<open>[\'"])']
+statement_end_re = re.compile(r'|'.join(statement_end_res))
+bytes_statement_end_re = re.compile(
+    r'|'.join(statement_end_res).encode('ascii'))
+space_re = re.compile(r'\s*')
+bytes_space_re = re.compile(br'\s*')
+newline_re = re.compile(r'\n')
+bytes_newline_re = re.compile(br'\n')
 
-reg_ex = r'|'.join(r'(%s)' % s for s in token_res)
-sql_re = re.compile(reg_ex, re.IGNORECASE)
+text_type = type(u'')
 
 
-STR_STARTERS = ('"', "'")
+def _text(source, start, end):
+    value = source[start:end]
+    if not isinstance(value, text_type):
+        value = codecs.decode(value, 'utf-8')
+    return value
 
 
-def cutter(s):
-    while s:
-        if s.startswith(STR_STARTERS):
-            starter = s[0]
-            for i, c in enumerate(s[1:]):
-                if c == starter:
-                    value = s[:i + 2]
-                    offset = len(value)
-                    yield value
-                    break
-            else:
-                raise StringNotTerminated(s)
-        else:
+class SourceSlice(object):
+    """Text of a token that is only copied out of the source on use."""
+
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return _text(self.source, self.start, self.end)
 
-            match = sql_re.match(s)
-            if match:
-                value = match.group(0)
-                offset = len(value)
-                yield value
+    __unicode__ = __str__
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __eq__(self, other):
+        return '%s' % self == '%s' % other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash('%s' % self)
+
+    def __repr__(self):
+        return repr('%s' % self)
+
+
+class LineIndex(object):
+    """Maps offsets into ``source`` to 1-based line and column numbers.
+
+    The offsets of all newlines are collected on the first lookup, every
+    lookup is a binary search over them.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._newlines = None
+
+    @property
+    def newlines(self):
+        if self._newlines is None:
+            if isinstance(self.source, text_type):
+                regex = newline_re
             else:
-                offset = 1
+                regex = bytes_newline_re
+            self._newlines = array(
+                'l', (match.start() for match in regex.finditer(self.source)))
+        return self._newlines
+
+    def location(self, offset):
+        newlines = self.newlines
+        line = bisect_left(newlines, offset)
+        line_start = newlines[line - 1] + 1 if line else 0
+        return line + 1, offset - line_start + 1
+
+
+class TokenStream(object):
+    """Token sequence read lazily from an iterator of Tokens.
+
+    Tokens are read ahead by ``lookahead`` past the furthest one indexed
+    so far, so ``len()`` is exact for every position up to that far away.
+    ``release(i)`` forgets the tokens before ``i``, only the tokens from
+    there on are held.
+    """
+
+    def __init__(self, tokens, lookahead):
+        self.tokens = iter(tokens)
+        self.lookahead = lookahead
+        self.buffer = []
+        self.start = 0
+        self.exhausted = False
+        self._read(lookahead)
+
+    def _read(self, stop):
+        # read until the token before index stop is buffered
+        missing = stop - self.start - len(self.buffer)
+        if missing > 0 and not self.exhausted:
+            self.buffer.extend(islice(self.tokens, missing))
+            if self.start + len(self.buffer) < stop:
+                self.exhausted = True
+
+    def release(self, i):
+        del self.buffer[:i - self.start]
+        self.start = i
+
+    def __len__(self):
+        return self.start + len(self.buffer)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, unused_step = i.indices(len(self))
+            return self.buffer[max(start - self.start, 0):stop - self.start]
+
+        if i < self.start:
+            raise IndexError('token %s was released' % i)
+        self._read(i + 1 + self.lookahead)
+        return self.buffer[i - self.start]
 
-        s = s[offset:]
+    def __repr__(self):
+        return '%s' % self.buffer
 
 
-def tokenize(s):
-    last_type = None
-    for word in cutter(s):
-        token_type = Token.get_token(word)
-        if token_type:
-            last_type = token_type
-            yield Token(token_type, word)
+def _utf8_length(text, start, end):
+    return len(text[start:end].encode('utf-8'))
+
+
+def _scan_decoded(s):
+    # the offsets of the tokens of the decoded text in the bytes
+    text = _text(s, 0, len(s))
+    pos = offset = 0
+    for token_type, start, end in _scan(text):
+        offset += _utf8_length(text, pos, start)
+        token_start = offset
+        offset += _utf8_length(text, start, end)
+        pos = end
+        yield token_type, token_start, offset
+
 
-        elif word[0].isdigit() or word.startswith(('+', '-')):
-            yield Token(Token.NUMBER, word)
+def _scan(s):
+    if isinstance(s, text_type):
+        lexer, str_starters = sql_re, STR_STARTERS
+    elif bytes_not_ascii_re.search(s):
+        for token in _scan_decoded(s):
+            yield token
+        return
+    else:
+        lexer, str_starters = sql_bytes_re, BYTES_STR_STARTERS
 
-        elif word.endswith('('):
+    last_type = None
+    pos = 0
+    length = len(s)
+    while pos < length:
+        match = lexer.match(s, pos)
+        if not match:
+            if s[pos:pos + 1] in str_starters:
+                raise StringNotTerminated(_text(s, pos, length))
+            pos += 1
+            continue
+
+        start, pos = match.span()
+        token_type = GROUP_TYPES[match.lastgroup]
+        if token_type is None:
+            continue
+
+        if token_type == Token.FUNC:
             if last_type == Token.INSERT:
                 token_type = Token.IDENTIFIER
+            name = match.group(0)[:-1].rstrip()
+            yield token_type, start, start + len(name)
+            token_type = Token.PARENTHESIS_OPEN
+            start = pos - 1
+
+        last_type = token_type
+        yield token_type, start, pos
+
+
+def split_statements(s):
+    """Yield a ``(start, end)`` span for every statement in ``s``.
+
+    Statements end after a semicolon outside of string literals, the same
+    way the tokenizer and read_chunks() see them. Leading whitespace is not
+    part of a span, a semicolon on its own is a span of its own and
+    whitespace after the last statement is left out. ``s`` is not
+    tokenized.
+    """
+    if isinstance(s, text_type):
+        regex, spaces = statement_end_re, space_re
+    else:
+        regex, spaces = bytes_statement_end_re, bytes_space_re
+
+    length = len(s)
+    start = spaces.match(s).end()
+    for match in regex.finditer(s):
+        if match.lastgroup == 'end':
+            yield start, match.end()
+            start = spaces.match(s, match.end()).end()
+        elif match.lastgroup == 'open':
+            break
+
+    if start < length:
+        yield start, length
+
+
+def is_file(s):
+    # a memory map has a read() method, too, but is tokenized in place
+    return hasattr(s, 'read') and not isinstance(s, mmap.mmap)
+
+
+def read_chunks(f, chunk_size=CHUNK_SIZE):
+    """Read ``f`` in chunks of ``chunk_size`` and yield its content in pieces
+    which end after a semicolon outside of string literals.
+
+    No token spans two pieces, so they can be tokenized one by one. A piece
+    is at most as big as a chunk plus the longest statement. Every chunk is
+    scanned once, the chunks of a piece are only joined when it is yielded.
+    """
+    pieces = []  # the text read since the last cut
+    tail = None  # the text of the last chunk which is scanned again
+    quote = None  # the quote of a string literal continued in the chunk
+
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+
+        if tail is None:
+            tail = empty = chunk[:0]
+            if isinstance(chunk, text_type):
+                regex, rest_res = chunk_re, str_rest_res
             else:
-                token_type = Token.FUNC
-            yield Token(token_type, word[:-1].strip())
-            yield Token(Token.PARENTHESIS_OPEN, '(')
-
-        elif word.startswith(STR_STARTERS):
-            yield Token(Token.STR, word)
-
-        elif word in ('=', '<>', '<', '>', '!=', '>=', '<=') or word.upper() == 'LIKE':
-            yield Token(Token.COMPARE, word)
+                regex, rest_res = bytes_chunk_re, bytes_str_rest_res
+
+        text = tail + chunk
+        pos = cut = 0
+        keep = len(text)
+        while True:
+            if quote is not None:
+                rest_re, open_rest_re = rest_res[quote]
+                match = rest_re.match(text, pos)
+                if not match:
+                    # The string literal is continued in the next chunk. A
+                    # backslash or quote at the end is scanned again with
+                    # it, it may escape its first character.
+                    keep = open_rest_re.match(text, pos).end()
+                    break
+                pos = match.end()
+                quote = None
 
-        elif word.upper() in ('AND', 'OR'):
-            yield Token(Token.LINK, word)
+            match = regex.search(text, pos)
+            if not match:
+                break
 
+            pos = match.end()
+            if match.group(0) in (';', b';'):
+                cut = pos
+            else:
+                quote = match.group(0)
+
+        if cut:
+            pieces.append(text[:cut])
+            yield empty.join(pieces)
+            pieces = []
+        pieces.append(text[cut:keep])
+        tail = text[keep:]
+
+    if tail is not None:
+        pieces.append(tail)
+        rest = empty.join(pieces)
+        if rest:
+            yield rest
+
+
+def tokenize(s, zero_copy=False, chunk_size=CHUNK_SIZE):
+    if is_file(s):
+        base = 0
+        for text in read_chunks(s, chunk_size):
+            for token in tokenize(text, zero_copy=zero_copy):
+                token._offset += base
+                yield token
+            base += len(text)
+        return
+
+    for token_type, start, end in _scan(s):
+        if zero_copy and token_type == Token.STR:
+            value = SourceSlice(s, start, end)
         else:
-            yield Token(Token.IDENTIFIER, word)
+            value = _text(s, start, end)
+        yield Token(token_type, value, start)
@@ -10,6 +10,7 @@ All rights reserved.
 from __future__ import print_function
 
 import sys
+from types import GeneratorType
 
 
 def print_data(msg):
@@ -18,3 +19,40 @@ def print_data(msg):
 
 def print_non_data(msg):
     print(msg, file=sys.stderr)
+
+
+def trampoline(call):
+    """Run the generator ``call`` and the generators it calls on an explicit
+    stack instead of the Python call stack.
+
+    A generator calls another one by yielding it and gets its result sent
+    back. The result of a generator is the first value it yields which is
+    not a generator, or None if it ends without one. An exception leaving a
+    generator is raised in its caller at the yield of the call.
+    """
+    stack = [call]
+    value = error = None
+    while True:
+        try:
+            if error is None:
+                result = stack[-1].send(value)
+            else:
+                raised, error = error, None
+                result = stack[-1].throw(raised)
+        except StopIteration:
+            result = None
+        except Exception as e:
+            stack.pop()
+            if not stack:
+                raise
+            error = e
+            continue
+
+        if isinstance(result, GeneratorType):
+            stack.append(result)
+            value = None
+        else:
+            stack.pop()
+            if not stack:
+                return result
+            value = result
@@ -13,8 +13,8 @@ from collections import namedtuple
 from format_sql.parser import (Between, Case, Condition, Else, From, Func,
                                GroupBy, Having, Identifier, Insert, Is, Join,
                                Limit, Link, Not, Null, Number, On, Operator,
-                               OrderBy, Select, Semicolon, Str, SubSelect,
-                               Values, When, Where)
+                               OrderBy, Parenthesis, Select, Semicolon, Str,
+                               SubSelect, Values, When, Where)
 from format_sql.tokenizer import Token
 from pytest import fixture
 
@@ -889,10 +889,7 @@ def where_4():
                           [
                               Identifier('x'),
                               Operator('in'),
-                              [
-                                  Number('1'),
-                                  Str('"3"')
-                              ]
+                              ('1', '"3"')
                           ])
                   ])
         ],
@@ -1164,6 +1161,99 @@ def where_12():
         ])
 
 
+@fixture
+def where_13():
+    return Data(
+        sql='where (a = 1 or not (b = 2 and c is null)) and d = 3',
+        tokens=[
+            Token(Token.WHERE, 'where'),
+            Token(Token.PARENTHESIS_OPEN, '('),
+            Token(Token.IDENTIFIER, 'a'),
+            Token(Token.COMPARE, '='),
+            Token(Token.NUMBER, '1'),
+            Token(Token.LINK, 'or'),
+            Token(Token.NOT, 'not'),
+            Token(Token.PARENTHESIS_OPEN, '('),
+            Token(Token.IDENTIFIER, 'b'),
+            Token(Token.COMPARE, '='),
+            Token(Token.NUMBER, '2'),
+            Token(Token.LINK, 'and'),
+            Token(Token.IDENTIFIER, 'c'),
+            Token(Token.IS, 'is'),
+            Token(Token.NULL, 'null'),
+            Token(Token.PARENTHESIS_CLOSE, ')'),
+            Token(Token.PARENTHESIS_CLOSE, ')'),
+            Token(Token.LINK, 'and'),
+            Token(Token.IDENTIFIER, 'd'),
+            Token(Token.COMPARE, '='),
+            Token(Token.NUMBER, '3'),
+        ],
+        statements=[
+            Where('where', [
+                Condition([Parenthesis([
+                    Condition([Identifier('a'), Operator('='), Number('1')]),
+                    Link('or'),
+                    Condition([Not('not'), Parenthesis([
+                        Condition([Identifier('b'), Operator('='),
+                                   Number('2')]),
+                        Link('and'),
+                        Condition([Identifier('c'), Is('is'),
+                                   Null('null')]),
+                    ])]),
+                ])]),
+                Link('and'),
+                Condition([Identifier('d'), Operator('='), Number('3')]),
+            ])
+        ],
+        style=[
+            'WHERE',
+            '    (',
+            '        a = 1',
+            '        OR NOT (',
+            '            b = 2',
+            '            AND c IS NULL))',
+            '    AND d = 3',
+        ])
+
+
+@fixture
+def where_14():
+    return Data(
+        sql='where length(x) > 1 and y between 1 and abs(z)',
+        tokens=[
+            Token(Token.WHERE, 'where'),
+            Token(Token.FUNC, 'length'),
+            Token(Token.PARENTHESIS_OPEN, '('),
+            Token(Token.IDENTIFIER, 'x'),
+            Token(Token.PARENTHESIS_CLOSE, ')'),
+            Token(Token.COMPARE, '>'),
+            Token(Token.NUMBER, '1'),
+            Token(Token.LINK, 'and'),
+            Token(Token.IDENTIFIER, 'y'),
+            Token(Token.BETWEEN, 'between'),
+            Token(Token.NUMBER, '1'),
+            Token(Token.LINK, 'and'),
+            Token(Token.FUNC, 'abs'),
+            Token(Token.PARENTHESIS_OPEN, '('),
+            Token(Token.IDENTIFIER, 'z'),
+            Token(Token.PARENTHESIS_CLOSE, ')'),
+        ],
+        statements=[
+            Where('where', [
+                Condition([Func('length', [Identifier('x')]), Operator('>'),
+                           Number('1')]),
+                Link('and'),
+                Condition([Identifier('y'), Between('between'), Number('1'),
+                           Link('and'), Func('abs', [Identifier('z')])]),
+            ])
+        ],
+        style=[
+            'WHERE',
+            '    LENGTH(x) > 1',
+            '    AND y BETWEEN 1 AND ABS(z)',
+        ])
+
+
 @fixture
 def composition_1():
     return Data(
@@ -1337,9 +1427,7 @@ def insert_1():
         statements=[
             Insert('insert into',
                    table='table_name',
-                   values=Values('values', [[Str('"value!"'),
-                                             Identifier('value2'),
-                                             Number('3')]]))
+                   values=Values('values', [('"value!"', 'value2', '3')]))
         ],
         style=[
             'INSERT INTO',
@@ -1377,11 +1465,9 @@ def insert_2():
             Insert('insert into',
                    table='table_name',
                    values=Values('values',
-                                 [[Str('"value!"'),
-                                   Identifier('value2'),
-                                   Number('3')],
-                                  [Str('"1"')],
-                                  [Str('"2"')]]))
+                                 [('"value!"', 'value2', '3'),
+                                  ('"1"',),
+                                  ('"2"',)]))
         ],
         style=[
             'INSERT INTO',
@@ -1419,9 +1505,7 @@ def insert_3():
         statements=[
             Insert('insert into',
                    table='table_name',
-                   values=Values('values', [[Str('"value!"'),
-                                             Identifier('value2'),
-                                             Number('3')]]),
+                   values=Values('values', [('"value!"', 'value2', '3')]),
                    cols=[Identifier('col1'),
                          Identifier('col2'),
                          Number('3')]
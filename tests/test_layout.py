@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+format-sql
+Makes your SQL readable.
+
+Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
+All rights reserved.
+
+"""
+import pytest
+from format_sql.layout import Begin, Break, End, layout
+
+
+def items(count, consistent=False):
+    doc = [Begin(consistent)]
+    for i in range(count):
+        if i:
+            doc.extend([',', Break(indent='  ')])
+        doc.append('x%d' % i)
+    doc.append(End())
+    return doc
+
+
+@pytest.mark.parametrize('consistent', [False, True])
+def test_layout_fits(consistent):
+    assert layout(items(3, consistent), 10) == ['x0, x1, x2']
+
+
+def test_layout_inconsistent():
+    assert layout(items(6), 10) == ['x0, x1,', '  x2, x3,', '  x4, x5']
+
+
+def test_layout_consistent():
+    assert layout(items(3, consistent=True), 9) == ['x0,', '  x1,', '  x2']
+
+
+def test_layout_column():
+    assert layout(items(3), 10, column=4) == ['x0,', '  x1, x2']
+
+
+def test_layout_nested():
+    doc = [Begin(consistent=True), 'f(', Break(blank=0, indent='  ')]
+    doc += items(4) + [')', End()]
+    assert layout(doc, 17) == ['f(x0, x1, x2, x3)']
+    assert layout(doc, 12) == ['f(', '  x0, x1,', '  x2, x3)']
+
+
+def test_layout_text_after_block():
+    # the text after a block has to fit on the line of its last item
+    doc = items(2) + ['))', Break(indent=''), 'y']
+    assert layout(doc, 7) == ['x0,', '  x1))', 'y']
+
+
+def test_layout_text_longer_than_line():
+    doc = ['abcdef', Break(), 'g']
+    assert layout(doc, 3) == ['abcdef', 'g']
+
+
+def test_layout_long_document():
+    lines = layout(items(100000), 79)
+    assert max(len(line) for line in lines) <= 79
+    assert ''.join(lines).replace(' ', '') == ','.join(
+        'x%d' % i for i in range(100000))
@@ -8,8 +8,12 @@ All rights reserved.
 
 """
 import pytest
-from format_sql.main import (_get_args, get_statements, handle_py_file,
+from format_sql import main as main_module
+from format_sql.main import (_format_parallel, _format_parallel_iter,
+                             _get_args, get_statements, handle_py_file,
                              handle_sql_file, main)
+from format_sql.parser import InvalidSQL
+from format_sql.shortcuts import format_sql
 from mock import call, patch
 
 try:
@@ -93,6 +97,43 @@ def test_sql_file_formatting(test_data, filename, expected_sql):
     assert result == expected_sql
 
 
+@pytest.mark.parametrize(('filename', 'expected_sql'), [
+    ('test_01/test_00.sql', 'SELECT\n    x\nFROM\n    k'),
+    ('test_01/test_01.sql', 'SELECT\n    x\nFROM\n    k;'),
+])
+def test_sql_file_formatting_with_mmap(test_data, filename, expected_sql):
+    test_filename = test_data.get_path(filename)
+    result = handle_sql_file(test_filename, mmap_threshold=1)
+    assert result == expected_sql
+
+
+def test_sql_file_formatting_with_mmap_keeps_utf8(tmpdir):
+    sql = u"select na\xefve from caf\xe9 where x = 'gr\xfc\xdfe';"
+    test_file = tmpdir.join('utf8.sql')
+    test_file.write_binary(sql.encode('utf-8'))
+
+    result = handle_sql_file(str(test_file), mmap_threshold=1)
+    assert result == (u"SELECT\n    na\xefve\nFROM\n    caf\xe9\n"
+                      u"WHERE\n    x = 'gr\xfc\xdfe';")
+
+
+@pytest.mark.parametrize('sql', [
+    u'select a from t;\nselect b from u where c = 1',
+    u"select a from t where b = 'x;y' and c = 'it''s';\ninsert into t "
+    u"values (1, 'a\\'b');",
+    u'select na\xefve, \u201cx\u201d from caf\xe9 where a\xa0= 1;',
+    u'select a from t\r\n  where b = 1;   \n\n',
+    u"select a from t where b in (%s);" % ', '.join(
+        "'%d'" % i for i in range(20000)),
+])
+def test_sql_file_formatting_with_mmap_like_without(tmpdir, sql):
+    test_file = tmpdir.join('test.sql')
+    test_file.write_binary(sql.encode('utf-8'))
+
+    result = handle_sql_file(str(test_file), mmap_threshold=1)
+    assert result == handle_sql_file(str(test_file))
+
+
 @pytest.mark.parametrize(('filename', 'expected_filename'), [
     ('test_02/test_00.py', 'test_02/test_00_expected.py'),
     ('test_02/test_01.py', 'test_02/test_01_expected.py'),
@@ -125,6 +166,121 @@ def test_multiple_statements_per_sql_file(test_data, filename, expected_filename
     assert result == expected_data
 
 
+@pytest.mark.parametrize('mmap_threshold', [0, 1])
+def test_multiple_statements_per_sql_file_with_jobs(test_data, mmap_threshold):
+    test_filename = test_data.get_path('test_03/before.sql')
+    expected_filename = test_data.get_path('test_03/after.sql')
+
+    result = handle_sql_file(test_filename, mmap_threshold=mmap_threshold,
+                             jobs=2)
+
+    with open(expected_filename) as f:
+        expected_data = f.read()
+
+    assert result == expected_data
+
+
+@pytest.mark.parametrize('batch_size', [1, 40, 1024])
+def test_format_parallel(batch_size):
+    sql = ("select a from t where x = 'y;z';\n"
+           "select b from u order by b desc limit 2;\n\n"
+           "select count(*) from u -- ;\n group by b;\n"
+           "select c from v")
+
+    assert _format_parallel(sql, jobs=2, batch_size=batch_size) == \
+        format_sql(sql)
+
+
+def test_format_parallel_reads_batches_ahead_of_jobs(monkeypatch):
+    spans = []
+    get_batches = main_module._get_batches
+
+    def counted_batches(sql, batch_size):
+        for span in get_batches(sql, batch_size):
+            spans.append(span)
+            yield span
+
+    monkeypatch.setattr(main_module, '_get_batches', counted_batches)
+    sql = 'select a from t;' * 100
+    lines = _format_parallel_iter(sql, jobs=2, batch_size=1)
+
+    first = next(lines)
+    assert len(spans) == 4
+    assert [first] + list(lines) == format_sql(sql)
+
+
+def test_sql_file_formatting_with_jobs_maps_file(tmpdir):
+    test_file = tmpdir.join('test.sql')
+    test_file.write('select a from t;')
+
+    with patch('format_sql.main._format_mapped_file',
+               wraps=main_module._format_mapped_file) as mocked:
+        result = handle_sql_file(str(test_file), mmap_threshold=None, jobs=2)
+
+    assert mocked.called
+    assert result == 'SELECT\n    a\nFROM\n    t;'
+
+
+def test_format_parallel_error_location():
+    sql = 'select a from t;\nselect b from u;\nselect c, from v;'
+
+    with pytest.raises(InvalidSQL) as excinfo:
+        _format_parallel(sql, jobs=2, batch_size=1)
+
+    assert (excinfo.value.line, excinfo.value.column) == (3, 11)
+
+
+@pytest.mark.parametrize(('mmap_threshold', 'jobs'), [
+    (None, 1), (1, 1), (None, 2), (1, 2)])
+def test_sql_file_formatting_with_recover(tmpdir, capsys, mmap_threshold,
+                                          jobs):
+    test_file = tmpdir.join('invalid.sql')
+    test_file.write('select a from t;\nselect b, from u;\nselect c from v;')
+
+    result = handle_sql_file(str(test_file), mmap_threshold=mmap_threshold,
+                             jobs=jobs, recover=True)
+
+    assert result == ('SELECT\n    a\nFROM\n    t;\n\n\n'
+                      'select b, from u;\n\n\n'
+                      'SELECT\n    c\nFROM\n    v;')
+    assert capsys.readouterr()[1] == (
+        'Statement left unformatted, InvalidSelect: line 2, column 11\n')
+
+
+@pytest.mark.parametrize(('mmap_threshold', 'jobs'), [
+    (None, 1), (1, 1), (None, 2), (1, 2)])
+def test_sql_file_formatting_with_max_line_length(tmpdir, mmap_threshold,
+                                                  jobs):
+    test_file = tmpdir.join('test.sql')
+    test_file.write('select alpha, beta, gamma from t;\n'
+                    'select a from t where b in (1, 2, 3, 4, 5, 6, 7, 8, 9);')
+
+    result = handle_sql_file(str(test_file), mmap_threshold=mmap_threshold,
+                             jobs=jobs, max_line_length=20)
+
+    assert result == ('SELECT\n    alpha, beta,\n    gamma\nFROM\n    t;\n\n\n'
+                      'SELECT\n    a\nFROM\n    t\nWHERE\n    b IN (\n'
+                      '        1, 2, 3, 4,\n        5, 6, 7, 8,\n        9);')
+
+
+@pytest.mark.parametrize('max_line_length', [1, 8])
+def test_py_file_formatting_with_max_line_length(tmpdir, max_line_length):
+    test_file = tmpdir.join('test.py')
+    test_file.write('def f():\n'
+                    '    if x:\n'
+                    '        s = """select a, b from t where c in (1, 2)"""\n')
+
+    with patch('format_sql.main.format_sql',
+               wraps=format_sql) as mocked_format_sql:
+        result = handle_py_file(str(test_file),
+                                max_line_length=max_line_length)
+
+    assert mocked_format_sql.call_args[1]['max_line_length'] == 1
+    assert result.splitlines()[3:5] == ['            SELECT',
+                                        '                a,']
+    assert '                    1,' in result.splitlines()
+
+
 def test_multiple_statements_in_python_string(test_data):
     test_filename = test_data.get_path('test_04/before.py')
     expected_filename = test_data.get_path('test_04/after.py')
@@ -156,6 +312,59 @@ def test_query_recognition_in_python_should_fail(input_):
         next(get_statements(input_))
 
 
+def test_sql_file_write_back(tmpdir):
+    test_file = tmpdir.join('test.sql')
+    test_file.write('select a from t;\nselect b from u')
+    test_file.chmod(0o640)
+
+    main([str(test_file)])
+
+    assert test_file.read() == ('SELECT\n    a\nFROM\n    t;\n\n\n'
+                                'SELECT\n    b\nFROM\n    u')
+    assert test_file.stat().mode & 0o777 == 0o640
+    assert tmpdir.listdir() == [test_file]
+
+
+def test_sql_file_write_back_through_links(tmpdir):
+    real_file = tmpdir.join('real.sql')
+    real_file.write('select a from t')
+    symlink = tmpdir.join('symlink.sql')
+    symlink.mksymlinkto(real_file)
+    hardlink = tmpdir.join('hardlink.sql')
+    hardlink.mklinkto(real_file)
+
+    main([str(symlink)])
+
+    assert symlink.islink()
+    assert real_file.read() == 'SELECT\n    a\nFROM\n    t'
+    assert hardlink.read() == real_file.read()
+
+
+def test_sql_file_write_back_keeps_invalid_file(tmpdir, capsys):
+    test_file = tmpdir.join('test.sql')
+    test_file.write('select a from t;\nselect b, from u;')
+
+    main([str(test_file)])
+
+    assert test_file.read() == 'select a from t;\nselect b, from u;'
+    assert tmpdir.listdir() == [test_file]
+    assert capsys.readouterr()[1].endswith('line 2, column 11\n')
+
+
+def test_dry_run_with_invalid_file(tmpdir, capsys):
+    invalid_file = tmpdir.join('a.sql')
+    invalid_file.write('select a from t; select from where;')
+    valid_file = tmpdir.join('b.sql')
+    valid_file.write('select b from u;')
+
+    main(['--dry-run', str(invalid_file), str(valid_file)])
+
+    out, err = capsys.readouterr()
+    assert 'SELECT\n    b\nFROM\n    u;\n' in out
+    assert 'line 1, column 25' in err
+    assert invalid_file.read() == 'select a from t; select from where;'
+
+
 def test_dry_run(test_data):
     expected_content = test_data.get_content('test_04/after.py')
     args = '%s --dry-run' % test_data.get_path('test_04/before.py')
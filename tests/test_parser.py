@@ -7,26 +7,67 @@ Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
+import collections
+
 import pytest
-from format_sql.parser import (Identifier, InvalidCondition, InvalidIdentifier,
-                               InvalidLimit, Number, _parse_identifier, parse)
-from format_sql.tokenizer import Token
+from format_sql import parser
+from format_sql.parser import (KEYWORDS, LOOKAHEAD, Condition, Func,
+                               Identifier, InvalidCondition, Insert,
+                               InvalidIdentifier, InvalidInsert,
+                               InvalidLimit, Join, Limit,
+                               Link, Not, Number, On, Operator, Parenthesis,
+                               Select, UnbalancedParenthesis, Where,
+                               _keyword, _normalize_keyword,
+                               _parse_identifier, parse)
+from format_sql.tokenizer import Token, TokenStream, tokenize
 
 
 def assert_statements(tokens1, statements2):
     parsed_statements = list(parse(tokens1))
     assert parsed_statements == statements2
+    # the same tokens read one by one from an iterator
+    assert list(parse(iter(tokens1))) == statements2
 
 
 @pytest.mark.parametrize(('tokens', 'exception'), [
     ([Token(Token.LIMIT, '')], InvalidLimit),
     ([Token(Token.WHERE, ''), Token(Token.IDENTIFIER, '')], InvalidCondition),
+    (list(tokenize('where (a = 1 and (b = 2)')), UnbalancedParenthesis),
+    (list(tokenize('where a in (1, 2')), UnbalancedParenthesis),
+    (list(tokenize('where a in (1 = 2)')), InvalidCondition),
+    (list(tokenize('where a = 1 and')), InvalidCondition),
+    (list(tokenize('where')), InvalidCondition),
+    (list(tokenize('select a from t join u on')), InvalidCondition),
+    (list(tokenize('insert into 5 values (1)')), InvalidInsert),
+    (list(tokenize('insert into t (a, f(b)) values (1)')), InvalidInsert),
+    (list(tokenize('insert into t (a as b)')), InvalidInsert),
+    (list(tokenize('insert into t (a')), UnbalancedParenthesis),
+    (list(tokenize('insert into')), InvalidInsert),
 ])
 def test_parse_exceptions(tokens, exception):
     with pytest.raises(exception):
         list(parse(tokens))
 
 
+@pytest.mark.parametrize(('sql', 'last'), [
+    ('select a from t where a = 1 and', 'and'),
+    ('select a from t where', 'where'),
+])
+def test_parse_conditions_at_end(sql, last):
+    with pytest.raises(InvalidCondition) as excinfo:
+        list(parse(tokenize(sql)))
+    assert excinfo.value.offset == sql.index(last)
+
+
+def test_parse_stray_closing_parenthesis():
+    sql = ('select a from t where b = 1);\nselect c from d;\n'
+           'insert into x values (1);')
+
+    with pytest.raises(UnbalancedParenthesis) as excinfo:
+        list(parse(tokenize(sql)))
+    assert excinfo.value.offset == sql.index(')')
+
+
 def test_parse_identifier_with_exception():
     with pytest.raises(InvalidIdentifier):
         _parse_identifier([])
@@ -55,6 +96,183 @@ def test_parse_identifier(tokens, expected_value, expected_count):
     assert result == expected_value
 
 
+def test_parse_identifier_at_position():
+    tokens = [Token(Token.SELECT, 'select'), Token(Token.IDENTIFIER, 'x'),
+              Token(Token.IDENTIFIER, 't')]
+
+    assert _parse_identifier(tokens, 1) == (Identifier('x', alias='t'), 3)
+
+
+def test_parse_in_after_first_condition():
+    tokens = tokenize('where x = 1 and y in (1, 2) limit 1')
+
+    assert list(parse(tokens)) == [
+        Where('where', [
+            Condition([Identifier('x'), Operator('='), Number('1')]),
+            Link('and'),
+            Condition([Identifier('y'), Operator('in'), ('1', '2')]),
+        ]),
+        Limit(Number('1')),
+    ]
+
+
+def test_parse_not_func_condition():
+    tokens = tokenize('where not count(x) > 1 and y = 2')
+
+    assert list(parse(tokens)) == [
+        Where('where', [
+            Condition([Not('not'), Func('count', [Identifier('x')]),
+                       Operator('>'), Number('1')]),
+            Link('and'),
+            Condition([Identifier('y'), Operator('='), Number('2')]),
+        ]),
+    ]
+
+
+def test_parse_deeply_nested_groups():
+    depth = 5000
+    tokens = tokenize('where ' + '(a = 1 or ' * depth + 'b = 2' + ')' * depth)
+
+    where, = parse(tokens)
+    conditions = where.conditions
+    for unused_level in range(depth):
+        group, = conditions[-1].values
+        assert isinstance(group, Parenthesis)
+        conditions = group.values
+    assert conditions == [
+        Condition([Identifier('a'), Operator('='), Number('1')]),
+        Link('or'),
+        Condition([Identifier('b'), Operator('='), Number('2')]),
+    ]
+
+
+def test_parse_deeply_nested_subselects():
+    depth = 5000
+    tokens = tokenize('where ' + 'a in (select a where ' * depth + 'b = 2' +
+                      ')' * depth)
+
+    where, = parse(tokens)
+    conditions = where.conditions
+    for unused_level in range(depth):
+        column, operator, subselect = conditions[0].values
+        assert operator == Operator('IN')
+        select, where = subselect.values
+        conditions = where.conditions
+    assert conditions == [
+        Condition([Identifier('b'), Operator('='), Number('2')]),
+    ]
+
+
+def test_parse_deeply_nested_funcs():
+    depth = 5000
+    tokens = tokenize('select ' + 'f(a, ' * depth + 'b' + ')' * depth)
+
+    select, = parse(tokens)
+    func, = select.values
+    for unused_level in range(depth):
+        assert func.args[0] == Identifier('a')
+        func = func.args[1]
+    assert func == Identifier('b')
+
+
+def test_parse_functions_run_once_per_position(monkeypatch):
+    calls = collections.Counter()
+
+    def count(func):
+        def counted(toks, i=0, *args):
+            calls[func.__name__, i] += 1
+            return func(toks, i, *args)
+        return counted
+
+    for name, func in list(vars(parser).items()):
+        if name.startswith('_parse'):
+            monkeypatch.setattr(parser, name, count(func))
+    for table in [parser.STRUCTURES, parser.PREDICATES]:
+        for key, func in list(table.items()):
+            monkeypatch.setitem(table, key, getattr(parser, func.__name__))
+
+    sql = ('select a, f(g(b), 1) as x from t1 '
+           'join t2 on t1.a = t2.b and not f(x) = 1 '
+           'left join t3 on (a = 1 or not (b in (1, 2))) '
+           'where a in (select b from c where d between 1 and f(2)) '
+           'and b is not null or not c like 2 '
+           'group by a having count(a) > 1 order by a desc limit 1, 2; '
+           'insert into t (a, b) values (1, 2), (3, 4); '
+           'insert into t select a from b where c = (select 1)')
+    list(parse(tokenize(sql)))
+
+    assert calls
+    assert max(calls.values()) == 1
+
+    # loops which do not get past a token raise instead of running forever
+    for sql in ['insert into t (a, f(b)) values (1)',
+                'insert into t (a as b)']:
+        calls.clear()
+        with pytest.raises(InvalidInsert):
+            list(parse(tokenize(sql)))
+        assert max(calls.values()) == 1
+
+
+def test_nodes_have_no_dict():
+    assert not hasattr(Identifier('x'), '__dict__')
+    assert not hasattr(Condition([]), '__dict__')
+
+
+def test_node_defaults_are_not_shared():
+    insert1, insert2 = Insert('insert', 't1'), Insert('insert', 't2')
+    insert1.cols.append(Identifier('x'))
+
+    assert insert2.cols == []
+    assert insert1.values is not insert2.values
+    assert insert1.select is not insert2.select
+    assert On('on').values is not On('on').values
+
+
+def test_keyword_nodes_are_shared():
+    where, = parse(tokenize('where a = 1 AND b = 2 and  c is  not null'))
+    first, link1, second, link2, third = where.conditions
+
+    assert link1 is link2
+    assert link1 == Link('and')
+    assert first.values[1] is second.values[1]
+    assert third.values[2] is _keyword(Not, 'NOT')
+
+
+def test_keyword_nodes_are_normalized():
+    assert Join('left   outer\njoin').value == 'LEFT OUTER JOIN'
+    assert _keyword(Join, 'Left Join') is _keyword(Join, 'LEFT  JOIN')
+    with pytest.raises(AttributeError):
+        Link('and').value = 'or'
+
+
+def test_keyword_cache_holds_normalized_values():
+    for spacing in [' ', '  ', '\n', ' \t ']:
+        _keyword(Join, 'left%sJoin' % spacing)
+
+    assert all(value == _normalize_keyword(value) for _, value in KEYWORDS)
+
+
+def test_parse_literal_rows():
+    sql = "insert into t values (1, 'a'), (2, b); where x in (3, '4')"
+    insert, semicolon, where = parse(tokenize(sql))
+
+    assert insert.values.values == [('1', "'a'"), ('2', 'b')]
+    assert where.conditions[0].values[2] == ('3', "'4'")
+
+
+def test_parse_reads_tokens_lazily():
+    tokens = TokenStream(tokenize('select a from t where b = 1; ' * 1000),
+                         LOOKAHEAD)
+    statements = parse(tokens)
+
+    assert next(statements) == Select('select', [Identifier('a')])
+    assert len(tokens) <= 3 + LOOKAHEAD
+
+    for unused_statement in statements:
+        assert len(tokens.buffer) <= 1 + LOOKAHEAD
+    assert len(tokens) == 9000
+
+
 def test_parse_from_1(from_1):
     assert_statements(from_1.tokens, from_1.statements)
 
@@ -227,6 +445,14 @@ def test_parse_where_12(where_12):
     assert_statements(where_12.tokens, where_12.statements)
 
 
+def test_parse_where_13(where_13):
+    assert_statements(where_13.tokens, where_13.statements)
+
+
+def test_parse_where_14(where_14):
+    assert_statements(where_14.tokens, where_14.statements)
+
+
 def test_parse_composition_1(composition_1):
     assert_statements(composition_1.tokens, composition_1.statements)
 
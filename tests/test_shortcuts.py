@@ -7,6 +7,8 @@ Copyright (c) 2014, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
+import io
+
 import pytest
 from format_sql.parser import InvalidSQL
 from format_sql.shortcuts import format_sql
@@ -15,3 +17,117 @@ from format_sql.shortcuts import format_sql
 def test_():
     with pytest.raises(InvalidSQL):
         format_sql("Select x T K")
+
+
+@pytest.mark.parametrize('source', [
+    u"select x from t where y = 'caf\xe9' and z = \"spam\"",
+    u"select x from t where y = 'caf\xe9' and z = \"spam\"".encode('utf-8'),
+    memoryview(u"select x from t where y = 'caf\xe9' and z = \"spam\"".encode('utf-8')),
+])
+def test_zero_copy(source):
+    expected = format_sql(u"select x from t where y = 'caf\xe9' and z = \"spam\"")
+
+    assert format_sql(source, zero_copy=True) == expected
+
+
+def test_statements_after_insert():
+    assert format_sql('insert into t values (1); select x from t;') == [
+        'INSERT INTO',
+        '    t',
+        'VALUES',
+        '    (1);',
+        '',
+        '',
+        'SELECT',
+        '    x',
+        'FROM',
+        '    t;',
+    ]
+
+
+def test_format_file():
+    sql = u"select x from t; select y from u where z = 'a;b'; select 1"
+
+    assert format_sql(io.StringIO(sql)) == format_sql(sql)
+
+
+@pytest.mark.parametrize('source', [
+    u'select a\n  from t;\nselect b,\n  from u',
+    io.StringIO(u'select a\n  from t;\nselect b,\n  from u'),
+    io.BytesIO(b'select a\n  from t;\nselect b,\n  from u'),
+])
+def test_error_location(source):
+    with pytest.raises(InvalidSQL) as excinfo:
+        format_sql(source)
+
+    error = excinfo.value
+    assert (error.offset, error.line, error.column) == (31, 4, 3)
+    assert str(error) == 'line 4, column 3'
+
+
+@pytest.mark.parametrize('source', [
+    u"select a from t;\nselect b,\n  from u;\nselect 'c",
+    io.StringIO(u"select a from t;\nselect b,\n  from u;\nselect 'c"),
+    io.BytesIO(b"select a from t;\nselect b,\n  from u;\nselect 'c"),
+])
+def test_recover(source):
+    errors = []
+
+    assert format_sql(source, on_error=errors.append) == [
+        'SELECT',
+        '    a',
+        'FROM',
+        '    t;',
+        '',
+        '',
+        'select b,',
+        '  from u;',
+        '',
+        '',
+        "select 'c",
+    ]
+    assert [(e.line, e.column) for e in errors] == [(3, 3), (4, 1)]
+    assert str(errors[1]) == 'String not terminated (line 4, column 1)'
+
+
+def test_recover_without_errors():
+    sql = 'select a from t; insert into t values (1); select b'
+    errors = []
+
+    assert format_sql(sql, on_error=errors.append) == format_sql(sql)
+    assert errors == []
+
+
+def test_recover_stray_closing_parenthesis():
+    sql = ('select a from t where b = 1);\nselect c from d;\n'
+           'insert into x values (1);')
+    errors = []
+
+    assert format_sql(sql, on_error=errors.append) == [
+        'select a from t where b = 1);', '', '',
+        'SELECT', '    c', 'FROM', '    d;', '', '',
+        'INSERT INTO', '    x', 'VALUES', '    (1);']
+    assert [(e.line, e.column) for e in errors] == [(1, 28)]
+
+
+@pytest.mark.parametrize(('sql', 'invalid'), [
+    ('select a from t; insert into 5 values (1);', '5'),
+    ('select a from t; insert into t (a, f(b)) values (1);', 'f('),
+    ('select a from t; insert into t (a as b);', 'as'),
+])
+def test_recover_invalid_insert(sql, invalid):
+    errors = []
+
+    assert format_sql(sql, on_error=errors.append) == [
+        'SELECT', '    a', 'FROM', '    t;', '', '', sql[17:]]
+    assert [e.offset for e in errors] == [sql.index(invalid)]
+
+
+def test_recover_splits_like_the_parser():
+    # comments are no SQL syntax, the semicolon ends the first statement
+    errors = []
+
+    assert format_sql('select a from t -- ;\nselect from;',
+                      on_error=errors.append) == [
+        'SELECT', '    a', 'FROM', '    t;', '', '', 'select from;']
+    assert len(errors) == 1
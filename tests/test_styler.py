@@ -9,7 +9,14 @@ All rights reserved.
 """
 from __future__ import unicode_literals
 
-from format_sql.styler import Liner, _style_func, style
+import attr
+import pytest
+from format_sql.parser import (Condition, Identifier, InvalidSQL, Link,
+                               Number, Operator, Where, parse)
+from format_sql.shortcuts import format_sql
+from format_sql.styler import (INDENTS, Liner, _style_func, style,
+                               style_iter)
+from format_sql.tokenizer import tokenize
 
 
 def assert_func_style(statements1, styled2):
@@ -22,6 +29,168 @@ def assert_style(statements1, styled2):
     assert style(statements1) == styled2
 
 
+class FrozenList(list):
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('FrozenList cannot be changed')
+
+    append = extend = insert = pop = remove = sort = reverse = _frozen
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _frozen
+
+
+def freeze(node):
+    # replaces every list in the tree with a FrozenList
+    if isinstance(node, list):
+        return FrozenList(freeze(x) for x in node)
+    if isinstance(node, tuple):
+        return tuple(freeze(x) for x in node)
+    if attr.has(node.__class__):
+        for field in attr.fields(node.__class__):
+            object.__setattr__(node, field.name,
+                               freeze(getattr(node, field.name)))
+    return node
+
+
+def test_liner():
+    liner = Liner()
+    with pytest.raises(IndexError):
+        liner.add_to_last_line(';')
+
+    liner.add_line('SELECT')
+    liner.add_to_line('    ')
+    liner.add_to_line(Identifier('a'))
+    liner.end_line()
+    liner.end_line()
+    liner.add_to_last_line(')')
+    liner.add_to_last_line(';')
+    liner.add_empty_lines(count=2)
+    liner.add_to_last_line('x')
+    liner.add_to_line('y')
+    liner.add_to_last_line('z')
+
+    assert liner.lines == ['SELECT', '    a);', '', 'yxz']
+
+
+@pytest.mark.parametrize('level', [0, 1, INDENTS.MAX_CACHED,
+                                   INDENTS.MAX_CACHED + 1])
+def test_indents(level):
+    assert INDENTS[level] == '    ' * level
+    assert (level in INDENTS) == (level <= INDENTS.MAX_CACHED)
+
+
+def test_style_does_not_change_statements():
+    sql = ('select a, f(b, g(c)) as n from t1 left join t2 on t1.id = t2.id '
+           'where not a = 1 and b between 1 and 2 and c is not null '
+           'and d in (1, 2) and e in (select e from u where not f = 2) '
+           'and (g = 1 or not h = 2) group by a having count(*) > 1 '
+           'order by a desc limit 10; '
+           'insert into t (a, b) values (1, 2)')
+    statements = freeze(list(parse(tokenize(sql))))
+
+    lines = style(statements)
+    assert lines == format_sql(sql)
+    assert style(statements) == lines
+    assert statements == list(parse(tokenize(sql)))
+
+
+@pytest.mark.parametrize(('sql', 'expected'), [
+    ('select a, b, c as x, f(d, e) from t where x = 1 and y = 2 '
+     'order by a desc, b',
+     ['SELECT', '    a, b, c AS x, F(d, e)', 'FROM', '    t', 'WHERE',
+      '    x = 1 AND y = 2', 'ORDER BY', '    a DESC, b']),
+    ('select alpha, beta, gamma, delta from t '
+     'where x = 1 and y = 2 and zzz = 3 group by a, b',
+     ['SELECT', '    alpha, beta, gamma, delta', 'FROM', '    t', 'WHERE',
+      '    x = 1', '    AND y = 2', '    AND zzz = 3', 'GROUP BY', '    a, b']),
+    ('select a from t where b in (1, 2, 3) '
+     'and c in (100, 200, 300, 400, 500, 600)',
+     ['SELECT', '    a', 'FROM', '    t', 'WHERE', '    b IN (1, 2, 3)',
+      '    AND c IN (', '        100, 200, 300, 400,', '        500, 600)']),
+    ('insert into t values (1, 2), (3, 4), (5, 6), (7, 8), (9, 10)',
+     ['INSERT INTO', '    t', 'VALUES', '    (1, 2), (3, 4), (5, 6),',
+      '    (7, 8), (9, 10)']),
+    ('insert into t values (100, 200, 300, 400, 500, 600, 700, 800)',
+     ['INSERT INTO', '    t', 'VALUES', '    (100, 200, 300, 400, 500,',
+      '        600, 700, 800)']),
+])
+def test_style_max_line_length(sql, expected):
+    assert style(parse(tokenize(sql)), max_line_length=30) == expected
+    assert list(style_iter(parse(tokenize(sql)),
+                           max_line_length=30)) == expected
+
+
+@pytest.mark.parametrize(('max_line_length', 'expected'), [
+    (None, ['    b <> (', '        1,', '        2)']),
+    (30, ['    b <> (1, 2)']),
+])
+def test_style_operator_with_literal_list(max_line_length, expected):
+    lines = style(parse(tokenize('select a from t where b <> (1, 2)')),
+                  max_line_length=max_line_length)
+    assert lines[5:] == expected
+
+
+@pytest.mark.parametrize('max_line_length', [None, 30])
+def test_style_where_without_conditions(max_line_length):
+    condition = Condition([Identifier('a'), Operator('='), Number('1')])
+
+    assert style([Where('where', [])],
+                 max_line_length=max_line_length) == ['WHERE']
+    with pytest.raises(InvalidSQL):
+        style([Where('where', [condition, Link('and')])],
+              max_line_length=max_line_length)
+    with pytest.raises(InvalidSQL):
+        list(style_iter([Where('where', [condition, Link('and')])],
+                        max_line_length=max_line_length))
+
+
+def test_style_max_line_length_long_list():
+    values = ', '.join('%d' % i for i in range(5000))
+    sql = 'select a from t where b in (%s)' % values
+
+    lines = style(parse(tokenize(sql)), max_line_length=79)
+    assert max(len(line) for line in lines) <= 79
+    assert len(lines) < 500
+    assert ' '.join(lines[6:]).replace(' ', '') == values.replace(' ', '') + ')'
+
+
+def test_style_deeply_nested_subselects():
+    depth = 5000
+    statements = parse(tokenize('select x where ' +
+                                'a in (select a where ' * depth + 'b = 2' +
+                                ')' * depth))
+
+    lines = style(statements)
+    assert lines[3:7] == ['    a IN (', '        SELECT', '            a',
+                          '        WHERE']
+    assert lines[-1] == ' ' * 4 * (2 * depth + 1) + 'b = 2' + ')' * depth
+
+
+def test_style_deeply_nested_funcs():
+    depth = 5000
+    liner = Liner()
+    func, = next(parse(tokenize('select ' + 'f(' * depth + ')' * depth))).values
+
+    _style_func(func, liner)
+    assert liner.lines == ['F(' * depth + ')' * depth]
+
+
+def test_style_iter():
+    sql = 'select a from t; select b from u where c = 1; select d'
+    parsed = []
+
+    def statements():
+        for statement in parse(tokenize(sql)):
+            parsed.append(statement)
+            yield statement
+
+    lines = style_iter(statements())
+    # the first line comes out before the rest is parsed
+    assert next(lines) == 'SELECT'
+    assert len(parsed) == 1
+
+    assert ['SELECT'] + list(lines) == style(parse(tokenize(sql)))
+
+
 def test_from_1(from_1):
     assert_style(from_1.statements, from_1.style)
 
@@ -194,6 +363,14 @@ def test_where_12(where_12):
     assert_style(where_12.statements, where_12.style)
 
 
+def test_where_13(where_13):
+    assert_style(where_13.statements, where_13.style)
+
+
+def test_where_14(where_14):
+    assert_style(where_14.statements, where_14.style)
+
+
 def test_composition_1(composition_1):
     assert_style(composition_1.statements, composition_1.style)
 
@@ -7,8 +7,12 @@ Copyright (c) 2014-2015, Friedrich Paetzke (paetzke@fastmail.fm)
 All rights reserved.
 
 """
+import io
+
 import pytest
-from format_sql.tokenizer import StringNotTerminated, Token, tokenize
+from format_sql.tokenizer import (LineIndex, SourceSlice, StringNotTerminated,
+                                  Token, TokenStream, read_chunks,
+                                  split_statements, tokenize)
 
 try:
     from itertools import zip_longest
@@ -120,6 +124,11 @@ def test_tokenize_numbers(sql, expected_token):
 @pytest.mark.parametrize(('sql', 'expected_token'), [
     ('"s s( ) ss"', (Token.STR, '"s s( ) ss"')),
     ("'s s( ) ss'", (Token.STR, "'s s( ) ss'")),
+    ("'it''s'", (Token.STR, "'it''s'")),
+    ("'it\\'s'", (Token.STR, "'it\\'s'")),
+    ("'C:\\\\'", (Token.STR, "'C:\\\\'")),
+    ('"say ""hi"" "', (Token.STR, '"say ""hi"" "')),
+    ('"a\\"b;\nc"', (Token.STR, '"a\\"b;\nc"')),
 ])
 def test_tokenize_strs(sql, expected_token):
     token_type, token_value = expected_token
@@ -207,12 +216,202 @@ def test_tokenize_link(sql, expected_token):
 @pytest.mark.parametrize('sql', [
     '"213',
     '"s s( ) ss\'',
+    "'it''",
+    "'it\\'",
 ])
 def test_tokenize_str_is_not_terminated(sql):
     with pytest.raises(StringNotTerminated):
         list(tokenize(sql))
 
 
+@pytest.mark.parametrize(('sql', 'expected_tokens'), [
+    ('1abc', [
+        (Token.NUMBER, '1'),
+        (Token.IDENTIFIER, 'abc'),
+    ]),
+    ("'x'and'y'", [
+        (Token.STR, "'x'"),
+        (Token.LINK, 'and'),
+        (Token.STR, "'y'"),
+    ]),
+])
+def test_tokenize_adjacent_words(sql, expected_tokens):
+    tokens = [Token(token_type, token_value)
+              for token_type, token_value in expected_tokens]
+
+    assert_tokens(tokens, tokenize(sql))
+
+
+@pytest.mark.parametrize(('sql', 'expected_tokens'), [
+    ('between (', [
+        (Token.BETWEEN, 'between'),
+        (Token.PARENTHESIS_OPEN, '('),
+    ]),
+    ('else (', [
+        (Token.ELSE, 'else'),
+        (Token.PARENTHESIS_OPEN, '('),
+    ]),
+    ('insert t(x)', [
+        (Token.INSERT, 'insert'),
+        (Token.IDENTIFIER, 't'),
+        (Token.PARENTHESIS_OPEN, '('),
+        (Token.IDENTIFIER, 'x'),
+        (Token.PARENTHESIS_CLOSE, ')'),
+    ]),
+    ('order(x)', [
+        (Token.FUNC, 'order'),
+        (Token.PARENTHESIS_OPEN, '('),
+        (Token.IDENTIFIER, 'x'),
+        (Token.PARENTHESIS_CLOSE, ')'),
+    ]),
+])
+def test_tokenize_keyword_before_parenthesis(sql, expected_tokens):
+    tokens = [Token(token_type, token_value)
+              for token_type, token_value in expected_tokens]
+
+    assert_tokens(tokens, tokenize(sql))
+
+
+def test_tokenize_long_input():
+    sql = 'select x from y;' * 10000
+    tokens = list(tokenize(sql))
+
+    assert len(tokens) == 50000
+    assert_tokens([Token(Token.SELECT, 'select'),
+                   Token(Token.IDENTIFIER, 'x'),
+                   Token(Token.FROM, 'from'),
+                   Token(Token.IDENTIFIER, 'y'),
+                   Token(Token.SEMICOLON, ';')] * 10000, tokens)
+
+
+def test_token_offsets():
+    sql = 'select x,\n  count(y) from t; select 1'
+    expected = [0, 7, 8, 12, 17, 18, 19, 21, 26, 27, 29, 36]
+
+    assert [tok._offset for tok in tokenize(sql)] == expected
+    assert [tok._offset for tok in tokenize(io.StringIO(sql),
+                                            chunk_size=4)] == expected
+
+
+@pytest.mark.parametrize(('offset', 'location'), [
+    (0, (1, 1)),
+    (3, (1, 4)),
+    (4, (2, 1)),
+    (5, (3, 1)),
+    (7, (3, 3)),
+    (8, (4, 1)),
+])
+def test_line_index(offset, location):
+    assert LineIndex('abc\n\nde\nf').location(offset) == location
+    assert LineIndex(b'abc\n\nde\nf').location(offset) == location
+
+
+def test_token_stream():
+    tokens = TokenStream(tokenize('select a, b, c from t where d = 1'), 2)
+    assert len(tokens) == 2
+
+    assert tokens[3]._value == 'b'
+    assert len(tokens) == 6
+    assert [t._value for t in tokens[4:]] == [',', 'c']
+
+    tokens.release(4)
+    assert tokens.buffer == tokens[4:6]
+    with pytest.raises(IndexError):
+        tokens[3]
+
+    assert tokens[11]._value == '1'
+    assert len(tokens) == 12
+    with pytest.raises(IndexError):
+        tokens[12]
+
+
+@pytest.mark.parametrize('source', [
+    u"select x from t where y = 'caf\xe9' and n\xe4me = 1".encode('utf-8'),
+    memoryview(u"select x from t where y = 'caf\xe9' and n\xe4me = 1".encode('utf-8')),
+])
+def test_tokenize_bytes(source):
+    expected = list(tokenize(u"select x from t where y = 'caf\xe9' and n\xe4me = 1"))
+
+    assert_tokens(expected, tokenize(source))
+
+
+@pytest.mark.parametrize('sql', [
+    u'select a\xa0from t',
+    u'select \u201cx\u201d from t',
+    u'select a\u3000b, f\xa0(c) from t where d = \'\xa0\'',
+    u'select a\x1cb from t',
+])
+def test_tokenize_bytes_like_text(sql):
+    source = sql.encode('utf-8')
+    tokens = list(tokenize(source))
+
+    assert_tokens(tokenize(sql), tokens)
+    # the offsets are those in the bytes
+    assert all(source[tok._offset:].decode('utf-8').startswith(tok._value)
+               for tok in tokens)
+
+
+def test_tokenize_zero_copy():
+    sql = "select x from t where y = 'spam' and z = 1"
+    tokens = list(tokenize(sql, zero_copy=True))
+
+    value = tokens[7]._value
+    assert isinstance(value, SourceSlice)
+    assert value.source is sql
+    assert (value.start, value.end) == (26, 32)
+    assert value == "'spam'"
+    assert '%s' % value == "'spam'"
+    assert tokens[9]._value == 'z'
+    assert not isinstance(tokens[9]._value, SourceSlice)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64])
+def test_read_chunks(chunk_size):
+    sql = ("select 'a;b' from t; select \"x';\" from u;\n"
+           "select 'it''s;' from v; select 'x\\';' from w; select 1")
+    chunks = list(read_chunks(io.StringIO(sql), chunk_size))
+
+    assert ''.join(chunks) == sql
+    for chunk in chunks[:-1]:
+        assert chunk.endswith(';')
+    assert chunks[-1].endswith('select 1')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 64])
+def test_tokenize_file(multiple_statements_1, chunk_size):
+    sql = multiple_statements_1.sql
+
+    assert_tokens(multiple_statements_1.tokens,
+                  tokenize(io.StringIO(sql), chunk_size=chunk_size))
+    assert_tokens(multiple_statements_1.tokens,
+                  tokenize(io.BytesIO(sql.encode('utf-8')),
+                           chunk_size=chunk_size))
+
+
+def test_tokenize_file_str_is_not_terminated():
+    with pytest.raises(StringNotTerminated):
+        list(tokenize(io.StringIO(u"select 'x; from t"), chunk_size=4))
+
+
+@pytest.mark.parametrize(('sql', 'statements'), [
+    ('', []),
+    ('  ;  ; ', [';', ';']),
+    ('select 1', ['select 1']),
+    ("select 'a;b' from t;\n select 2;", ["select 'a;b' from t;", 'select 2;']),
+    ("select 'it''s;'; select 'x\\';'", ["select 'it''s;';", "select 'x\\';'"]),
+    ('select 1 -- no; end\n; select /* ; */ 2',
+     ['select 1 -- no;', 'end\n;', 'select /* ;', '*/ 2']),
+    ("select 1; select 'x; from t", ['select 1;', "select 'x; from t"]),
+    ("select 1 -- it's; 2", ["select 1 -- it's; 2"]),
+])
+def test_split_statements(sql, statements):
+    assert [sql[start:end] for start, end in split_statements(sql)] == statements
+
+    data = sql.encode('utf-8')
+    assert [data[start:end].decode('utf-8')
+            for start, end in split_statements(data)] == statements
+
+
 def test_tokenize_from_1(from_1):
     assert_tokens(from_1.tokens, tokenize(from_1.sql))
 
@@ -385,6 +584,14 @@ def test_tokenize_where_12(where_12):
     assert_tokens(where_12.tokens, tokenize(where_12.sql))
 
 
+def test_tokenize_where_13(where_13):
+    assert_tokens(where_13.tokens, tokenize(where_13.sql))
+
+
+def test_tokenize_where_14(where_14):
+    assert_tokens(where_14.tokens, tokenize(where_14.sql))
+
+
 def test_tokenize_composition_1(composition_1):
     assert_tokens(composition_1.tokens, tokenize(composition_1.sql))
 